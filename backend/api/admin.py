@@ -9,14 +9,22 @@ class IngredientAdmin(admin.ModelAdmin):
     search_fields = ('^name',)
 
 
-class RecipeAdmin(admin.ModelAdmin):
-    list_display = ('author', 'name', 'favorited')
-    list_filter = ('author', 'name', 'tags')
+class AmountIngredientInline(admin.TabularInline):
+    model = AmountIngredient
+    autocomplete_fields = ('ingredient',)
+    extra = 1
+    min_num = 1
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related('ingredient')
 
-    def favorited(self, obj):
-        return Favorite.objects.filter(recipe=obj).count()
 
-    favorited.short_description = 'В избранном'
+class RecipeAdmin(admin.ModelAdmin):
+    inlines = (AmountIngredientInline,)
+    list_display = ('author', 'name', 'favorites_count', 'in_carts_count')
+    list_filter = ('author', 'name', 'tags')
+    list_select_related = ('author',)
+    readonly_fields = ('favorites_count', 'in_carts_count')
 
 
 class TagAdmin(admin.ModelAdmin):
@@ -45,4 +53,4 @@ admin.site.register(Tag, TagAdmin)
 admin.site.register(Purchase, PurchaseAdmin)
 admin.site.register(Favorite, FavoriteAdmin)
 admin.site.register(Follow, SubscriptionAdmin)
-admin.site.register(AmountIngredient)
+admin.site.register(AmountIngredient, RecipeIngredientAdmin)
@@ -0,0 +1,18 @@
+from rest_framework.authentication import TokenAuthentication
+
+from .caches import token_cache
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """ TokenAuthentication, запоминающая найденных пользователей
+    в TokenCache: без изменений пользователя и его токенов запрос
+    к таблицам токенов и пользователей не выполняется.
+    """
+
+    def authenticate_credentials(self, key):
+        cached = token_cache.get(key)
+        if cached is not None:
+            return cached
+        user, token = super().authenticate_credentials(key)
+        token_cache.set(key, user, token)
+        return user, token
@@ -0,0 +1,339 @@
+import copy
+import hashlib
+import time
+from collections import OrderedDict
+from threading import Lock, local
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import router, transaction
+from django.db.models import CharField, Value
+
+from .models import (ContentVersion, Favorite, Follow, Ingredient, Purchase,
+                     Tag)
+
+# Счётчики ContentVersion, которые читаются вместе с любыми другими:
+# от них зависят кэши справочников, аутентификация и условные запросы,
+# так что за HTTP-запрос версии обычно читаются одним запросом.
+WATCHED_VERSION_KEYS = ('tags', 'ingredients', 'users', 'recipes')
+
+_versions = local()
+
+
+def reset_versions():
+    """ Забывает прочитанные версии: следующий запрос к кэшу в этом
+    потоке заново сверится с базой данных.
+    """
+    _versions.values = None
+
+
+def _get_versions(using):
+    values = getattr(_versions, 'values', None)
+    if (values is None or time.monotonic() - _versions.checked_at
+            > settings.REFERENCE_CACHE_VERSION_TTL):
+        values = _versions.values = {}
+        _versions.checked_at = time.monotonic()
+    return values.setdefault(using, {})
+
+
+def get_versions(keys, using=None):
+    """ Словарь {ключ: (версия, время изменения)} для `keys`.
+
+    Версии читаются из базы данных одним запросом не чаще раза за
+    HTTP-запрос (сброс по сигналу request_started), а вне запросов -
+    не реже, чем раз в REFERENCE_CACHE_VERSION_TTL секунд. Так
+    изменения, сделанные в других процессах gunicorn, становятся видны
+    всем процессам.
+
+    По умолчанию версии читаются из той же базы, что и данные запроса
+    (реплики или основной): кэш, заполненный из отстающей реплики,
+    получает версию этой же реплики и не выдаётся за более новый.
+    """
+    if using is None:
+        using = router.db_for_read(ContentVersion)
+    values = _get_versions(using)
+    missing = set(keys).difference(values)
+    if missing:
+        missing.update(set(WATCHED_VERSION_KEYS).difference(values))
+        values.update(
+            ContentVersion.objects.using(using).get_versions(missing)
+        )
+    return {key: values[key] for key in keys}
+
+
+def get_version(key):
+    """ Текущая версия `key`."""
+    return get_versions((key,))[key][0]
+
+
+class VersionedCache:
+    """ Кэш объектов модели по id в памяти процесса.
+
+    Объекты загружаются из базы данных при первом обращении (read-through)
+    и хранятся, пока не изменится счётчик ContentVersion `version_key`.
+    Счётчики попаданий и промахов доступны через `stats`.
+    """
+
+    def __init__(self, model, version_key):
+        self.model = model
+        self.version_key = version_key
+        self._objects = {}
+        self._version = None
+        self._complete = False
+        self._lock = Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _current(self):
+        """ Объекты текущей версии; при смене версии кэш очищается."""
+        version = get_version(self.version_key)
+        with self._lock:
+            if version != self._version:
+                self._objects = {}
+                self._version = version
+                self._complete = False
+            return self._objects
+
+    def get_many(self, ids):
+        """ Возвращает словарь {id: объект} для существующих `ids`."""
+        objects = self._current()
+        found = {}
+        missing = []
+        for object_id in ids:
+            obj = objects.get(object_id)
+            if obj is None:
+                missing.append(object_id)
+            else:
+                found[object_id] = obj
+        if missing:
+            loaded = self.model.objects.in_bulk(missing)
+            objects.update(loaded)
+            found.update(loaded)
+        with self._lock:
+            self.hits += len(ids) - len(missing)
+            self.misses += len(missing)
+        return found
+
+    def get(self, object_id):
+        return self.get_many((object_id,)).get(object_id)
+
+    def all(self):
+        """ Все объекты модели: таблица загружается целиком один раз
+        на версию. Подходит только для небольших справочников.
+        """
+        objects = self._current()
+        if self._complete:
+            with self._lock:
+                self.hits += 1
+            return list(objects.values())
+        loaded = {obj.pk: obj for obj in self.model.objects.all()}
+        with self._lock:
+            self.misses += 1
+            if objects is self._objects:
+                objects.update(loaded)
+                self._complete = True
+        return list(loaded.values())
+
+    def invalidate(self):
+        with self._lock:
+            self._objects = {}
+            self._version = None
+            self._complete = False
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'size': len(self._objects),
+            'version': self._version,
+        }
+
+
+tag_cache = VersionedCache(Tag, 'tags')
+ingredient_cache = VersionedCache(Ingredient, 'ingredients')
+
+
+class TokenCache:
+    """ Кэш аутентификации по токену: пара (пользователь, токен)
+    по ключу токена.
+
+    В памяти процесса хранится не больше settings.TOKEN_CACHE_SIZE
+    записей (вытесняются давно не использованные) не дольше
+    settings.TOKEN_CACHE_TIMEOUT секунд. С settings.TOKEN_CACHE_SHARED
+    записи хранятся и в кэше Django, общем для процессов.
+
+    Запись действительна, пока не изменился счётчик ContentVersion
+    `user:<id>` этого пользователя (изменение пользователя, удаление
+    токенов, изменение его счётчиков), поэтому выход из системы в одном
+    процессе сразу видят все, а изменения других пользователей записи
+    не сбрасывают.
+    """
+
+    def __init__(self):
+        self._entries = OrderedDict()
+        self._lock = Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def get_shared_key(key):
+        return f'auth-token:{hashlib.sha256(key.encode()).hexdigest()}'
+
+    @staticmethod
+    def get_versions(user_id):
+        # Токены читаются из основной базы, и отзыв не должен ждать
+        # реплику.
+        user_key = ContentVersion.user_key(user_id)
+        return get_versions((user_key,), using='default')[user_key][0]
+
+    def get(self, key):
+        """ Пара (пользователь, токен) или None. Пользователь
+        копируется: представления могут изменять request.user.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+        if entry is not None and entry[0] < time.monotonic():
+            entry = None
+        if entry is None and settings.TOKEN_CACHE_SHARED:
+            shared = cache.get(self.get_shared_key(key))
+            if shared is not None:
+                entry = (
+                    time.monotonic() + settings.TOKEN_CACHE_TIMEOUT, *shared
+                )
+        if entry is not None:
+            _, versions, user, token = entry
+            if versions == self.get_versions(user.id):
+                with self._lock:
+                    self.hits += 1
+                    self._entries[key] = entry
+                return copy.copy(user), token
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def set(self, key, user, token):
+        entry = (
+            time.monotonic() + settings.TOKEN_CACHE_TIMEOUT,
+            self.get_versions(user.id), copy.copy(user), token,
+        )
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > settings.TOKEN_CACHE_SIZE:
+                self._entries.popitem(last=False)
+        if settings.TOKEN_CACHE_SHARED:
+            cache.set(
+                self.get_shared_key(key), entry[1:],
+                settings.TOKEN_CACHE_TIMEOUT
+            )
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+        if settings.TOKEN_CACHE_SHARED:
+            cache.delete(self.get_shared_key(key))
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'size': len(self._entries),
+        }
+
+
+token_cache = TokenCache()
+
+
+class UserMemberships:
+    """ Множества id избранных рецептов, рецептов в списке покупок
+    и авторов, на которых подписан пользователь.
+
+    Хранятся в кэше Django под ключом `memberships:<id пользователя>`
+    вместе с версией счётчика ContentVersion `user:<id>`, при которой
+    были получены.
+    """
+
+    def __init__(self, version, favorites=(), purchases=(), following=()):
+        self.version = version
+        self.favorites = set(favorites)
+        self.purchases = set(purchases)
+        self.following = set(following)
+
+
+# Модель связи -> (множество в UserMemberships, поле с id объекта).
+MEMBERSHIP_FIELDS = {
+    Favorite: ('favorites', 'recipe_id'),
+    Purchase: ('purchases', 'recipe_id'),
+    Follow: ('following', 'author_id'),
+}
+
+
+def get_memberships_key(user_id):
+    return f'memberships:{user_id}'
+
+
+def load_memberships(user_id, version):
+    """ Загружает множества пользователя одним запросом."""
+    querysets = [
+        model.objects.filter(user_id=user_id).annotate(
+            kind=Value(kind, output_field=CharField())
+        ).values_list('kind', field).order_by()
+        for model, (kind, field) in MEMBERSHIP_FIELDS.items()
+    ]
+    memberships = UserMemberships(version)
+    for kind, object_id in querysets[0].union(*querysets[1:], all=True):
+        getattr(memberships, kind).add(object_id)
+    return memberships
+
+
+def get_memberships(request):
+    """ Множества текущего пользователя: одно обращение к кэшу за запрос,
+    загрузка из базы данных только после изменения версии.
+    """
+    memberships = getattr(request, '_memberships', None)
+    if memberships is not None:
+        return memberships
+    user_id = request.user.id
+    version = get_version(ContentVersion.user_key(user_id))
+    key = get_memberships_key(user_id)
+    memberships = cache.get(key)
+    if memberships is None or memberships.version != version:
+        memberships = load_memberships(user_id, version)
+        cache.set(key, memberships, settings.MEMBERSHIP_CACHE_TIMEOUT)
+    request._memberships = memberships
+    return memberships
+
+
+def update_memberships(instance, added):
+    """ После фиксации транзакции добавляет связь `instance` в множества
+    пользователя или удаляет её.
+
+    Вызывается после увеличения версии `user:<id>`. Если с версии
+    закэшированных множеств произошло больше одного изменения,
+    множества удаляются из кэша и будут загружены заново.
+    """
+    kind, field = MEMBERSHIP_FIELDS[type(instance)]
+    user_id, object_id = instance.user_id, getattr(instance, field)
+
+    def apply():
+        key = get_memberships_key(user_id)
+        memberships = cache.get(key)
+        if memberships is None:
+            return
+        user_key = ContentVersion.user_key(user_id)
+        version = ContentVersion.objects.get_versions([user_key])[
+            user_key
+        ][0]
+        if memberships.version != version - 1:
+            cache.delete(key)
+            return
+        memberships.version = version
+        if added:
+            getattr(memberships, kind).add(object_id)
+        else:
+            getattr(memberships, kind).discard(object_id)
+        cache.set(key, memberships, settings.MEMBERSHIP_CACHE_TIMEOUT)
+
+    transaction.on_commit(apply)
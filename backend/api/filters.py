@@ -1,8 +1,15 @@
 import django_filters as filters
+from django.db.models import Exists, OuterRef
 
+from .caches import tag_cache
 from .models import Ingredient, Recipe, User
 
 
+def tag_choices():
+    """ Слаги тэгов из кэша справочников, без запроса к базе данных."""
+    return [(tag.slug, tag.name) for tag in tag_cache.all()]
+
+
 class IngredientNameFilter(filters.FilterSet):
     name = filters.CharFilter(
         field_name='name',
@@ -15,8 +22,21 @@ class IngredientNameFilter(filters.FilterSet):
 
 
 class RecipeFilter(filters.FilterSet):
-    tags = filters.AllValuesMultipleFilter(
-        field_name='tags__slug'
+    """ Фильтр рецептов.
+
+    `tags` принимает несколько слагов: по умолчанию выводятся рецепты
+    хотя бы с одним из тэгов, с `tags_mode=all` - только со всеми.
+    Тэги проверяются через EXISTS по таблице связи, поэтому рецепты
+    не повторяются и DISTINCT не нужен.
+    """
+
+    tags = filters.MultipleChoiceFilter(
+        choices=tag_choices,
+        method='get_tags'
+    )
+    tags_mode = filters.ChoiceFilter(
+        choices=(('any', 'Любой из тэгов'), ('all', 'Все тэги')),
+        method='get_tags_mode'
     )
     author = filters.ModelChoiceFilter(
         queryset=User.objects.all()
@@ -27,10 +47,28 @@ class RecipeFilter(filters.FilterSet):
     is_in_shopping_cart = filters.NumberFilter(
         method='get_is_in_shopping_cart'
     )
+    search = filters.CharFilter(
+        method='get_search'
+    )
 
     class Meta:
         model = Recipe
-        fields = ['tags', 'author', 'is_favorited', 'is_in_shopping_cart']
+        fields = ['tags', 'tags_mode', 'author', 'is_favorited',
+                  'is_in_shopping_cart', 'search']
+
+    def get_tags(self, queryset, name, value):
+        if not value:
+            return queryset
+        ids = [tag.id for tag in tag_cache.all() if tag.slug in value]
+        links = Recipe.tags.through.objects.filter(recipe=OuterRef('pk'))
+        if self.form.cleaned_data.get('tags_mode') == 'all':
+            for tag_id in ids:
+                queryset = queryset.filter(Exists(links.filter(tag=tag_id)))
+            return queryset
+        return queryset.filter(Exists(links.filter(tag__in=ids)))
+
+    def get_tags_mode(self, queryset, name, value):
+        return queryset
 
     def get_is_favorited(self, queryset, name, value):
         if value:
@@ -41,3 +79,8 @@ class RecipeFilter(filters.FilterSet):
         if value:
             return queryset.filter(purchases__user=self.request.user)
         return queryset
+
+    def get_search(self, queryset, name, value):
+        if value.strip():
+            return queryset.search(value)
+        return queryset
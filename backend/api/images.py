@@ -0,0 +1,86 @@
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+from PIL import Image
+
+from .models import ContentVersion, Recipe
+
+logger = logging.getLogger(__name__)
+
+IMAGE_EXECUTOR = ThreadPoolExecutor(
+    max_workers=settings.IMAGE_VARIANT_WORKERS,
+    thread_name_prefix='image-variants',
+)
+
+
+def get_variant_path(name, width):
+    stem = os.path.splitext(os.path.basename(name))[0]
+    return f'recipes/variants/{stem}_{width}w.webp'
+
+
+def build_variants(name):
+    """ Создаёт уменьшенные копии изображения в формате WebP шириной
+    из settings.IMAGE_VARIANT_WIDTHS и возвращает словарь
+    вида {'320w': 'recipes/variants/...'}.
+    """
+    with default_storage.open(name) as file:
+        image = Image.open(file)
+        image.load()
+    if image.mode not in ('RGB', 'RGBA'):
+        image = image.convert('RGBA' if 'A' in image.getbands() else 'RGB')
+    variants = {}
+    for width in settings.IMAGE_VARIANT_WIDTHS:
+        variant = image.copy()
+        variant.thumbnail((width, image.height))
+        buffer = BytesIO()
+        variant.save(
+            buffer, 'WEBP', quality=settings.IMAGE_VARIANT_QUALITY
+        )
+        variants[f'{width}w'] = default_storage.save(
+            get_variant_path(name, width), ContentFile(buffer.getvalue())
+        )
+    return variants
+
+
+def save_variants(recipe_id, name):
+    """ Сохраняет варианты изображения рецепта, если за время обработки
+    изображение не было заменено.
+    """
+    variants = build_variants(name)
+    updated = Recipe.objects.filter(id=recipe_id, image=name).update(
+        image_variants=variants, updated_at=timezone.now()
+    )
+    if updated:
+        ContentVersion.objects.bump('recipes')
+
+
+def process_recipe_image(recipe_id, name):
+    """ Задача пула потоков: подключения к базе данных в потоке пула
+    не закрываются обработчиком запроса, поэтому устаревшие закрываются
+    до и после задачи. Любая ошибка пишется в журнал, иначе её молча
+    поглотит Future.
+    """
+    close_old_connections()
+    try:
+        save_variants(recipe_id, name)
+    except Exception:
+        logger.exception('Не удалось обработать изображение %s', name)
+    finally:
+        close_old_connections()
+
+
+def schedule_image_variants(recipe):
+    """ Ставит обработку изображения рецепта в очередь пула потоков
+    после фиксации текущей транзакции.
+    """
+    recipe_id, name = recipe.id, recipe.image.name
+    transaction.on_commit(
+        lambda: IMAGE_EXECUTOR.submit(process_recipe_image, recipe_id, name)
+    )
@@ -0,0 +1,212 @@
+import gzip
+import re
+from array import array
+from bisect import bisect_left
+from collections import Counter
+from threading import Lock
+
+from django.conf import settings
+
+from .caches import get_version
+from .models import Ingredient
+
+MAX_CHAR = chr(0x10FFFF)
+
+# Порог схожести совпадает с pg_trgm.similarity_threshold по умолчанию.
+TRIGRAM_SIMILARITY_THRESHOLD = 0.3
+
+WORD_RE = re.compile(r'[^\W_]+')
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+class IngredientEntry:
+    """ Запись индекса ингредиентов.
+
+    Атрибуты совпадают с полями модели Ingredient, поэтому записи можно
+    передавать в IngredientSerializer вместо объектов модели.
+    """
+
+    __slots__ = ('id', 'name', 'measurement_unit')
+
+    def __init__(self, id, name, measurement_unit):
+        self.id = id
+        self.name = name
+        self.measurement_unit = measurement_unit
+
+
+class BaseIngredientIndex:
+    """ Базовый класс индексов ингредиентов в памяти процесса.
+
+    Индекс строится лениво при первом обращении и перестраивается
+    после `invalidate` или при изменении версии `ingredients`
+    в ContentVersion, в том числе из другого процесса. Наследники
+    реализуют `prepare`, который превращает список записей в структуру
+    для поиска.
+    """
+
+    def __init__(self):
+        self._data = None
+        self._lock = Lock()
+
+    def prepare(self, entries):
+        raise NotImplementedError
+
+    def build(self):
+        version = get_version('ingredients')
+        entries = [
+            IngredientEntry(*row)
+            for row in Ingredient.objects.values_list(
+                'id', 'name', 'measurement_unit'
+            ).order_by()
+        ]
+        self._data = (version, self.prepare(entries))
+
+    def invalidate(self):
+        self._data = None
+
+    def _get_data(self):
+        version = get_version('ingredients')
+        data = self._data
+        if data is None or data[0] != version:
+            with self._lock:
+                data = self._data
+                if data is None or data[0] != version:
+                    self.build()
+                    data = self._data
+        return data[1]
+
+
+class IngredientPrefixIndex(BaseIngredientIndex):
+    """ Поиск по началу названия без учёта регистра.
+
+    Названия хранятся в отсортированном массиве в `casefold`-форме,
+    поиск префикса выполняется двоичным поиском.
+    """
+
+    def prepare(self, entries):
+        entries.sort(key=lambda entry: (entry.name.casefold(), entry.id))
+        return [entry.name.casefold() for entry in entries], entries
+
+    def search(self, prefix, limit=None):
+        """ Возвращает не более `limit` ингредиентов, название которых
+        начинается с `prefix`, в порядке названий.
+        """
+        keys, entries = self._get_data()
+        prefix = prefix.casefold()
+        start = bisect_left(keys, prefix)
+        end = bisect_left(keys, prefix + MAX_CHAR, lo=start)
+        if limit is not None:
+            end = min(end, start + limit)
+        return entries[start:end]
+
+
+def get_trigrams(text):
+    """ Множество триграмм строки, как его строит pg_trgm: каждое слово
+    в нижнем регистре дополняется двумя пробелами слева и одним справа.
+    """
+    trigrams = set()
+    for word in WORD_RE.findall(text.casefold()):
+        padded = f'  {word} '
+        trigrams.update(
+            padded[index:index + 3] for index in range(len(padded) - 2)
+        )
+    return trigrams
+
+
+class IngredientTrigramIndex(BaseIngredientIndex):
+    """ Нечёткий поиск по триграммам названий.
+
+    Инвертированный индекс хранит для каждой триграммы массив номеров
+    ингредиентов. Схожесть считается так же, как функция `similarity`
+    из pg_trgm: отношение общих триграмм ко всем триграммам обеих строк.
+    """
+
+    def prepare(self, entries):
+        postings = {}
+        sizes = array('H')
+        for position, entry in enumerate(entries):
+            trigrams = get_trigrams(entry.name)
+            sizes.append(len(trigrams))
+            for trigram in trigrams:
+                postings.setdefault(trigram, array('I')).append(position)
+        return postings, sizes, entries
+
+    def search(self, query, limit=None,
+               threshold=TRIGRAM_SIMILARITY_THRESHOLD):
+        """ Возвращает ингредиенты со схожестью названия не ниже
+        `threshold`, от наиболее похожих к менее похожим.
+        """
+        postings, sizes, entries = self._get_data()
+        trigrams = get_trigrams(query)
+        if not trigrams:
+            return []
+        shared = Counter()
+        for trigram in trigrams:
+            shared.update(postings.get(trigram, ()))
+        ranked = []
+        for position, common in shared.items():
+            similarity = common / (len(trigrams) + sizes[position] - common)
+            if similarity >= threshold:
+                ranked.append((-similarity, entries[position].name, position))
+        ranked.sort()
+        return [entries[position] for _, _, position in ranked[:limit]]
+
+
+def compress(body):
+    """ Тело ответа во всех поддерживаемых кодировках:
+    {кодировка: байты}. brotli - только если установлен пакет Brotli.
+    """
+    encodings = {
+        'identity': body,
+        'gzip': gzip.compress(body, compresslevel=9, mtime=0),
+    }
+    if brotli is not None:
+        encodings['br'] = brotli.compress(body)
+    return encodings
+
+
+class IngredientResponseCache:
+    """ Готовые тела ответов списка ингредиентов, сжатые заранее.
+
+    Тело по ключу запроса формируется и сжимается один раз на версию
+    `ingredients`; хранится не больше settings.INGREDIENT_RESPONSE_CACHE_SIZE
+    тел. При смене версии или после `invalidate` кэш очищается.
+    """
+
+    def __init__(self):
+        self._data = None
+        self._lock = Lock()
+
+    def invalidate(self):
+        self._data = None
+
+    def _get_responses(self):
+        version = get_version('ingredients')
+        data = self._data
+        if data is None or data[0] != version:
+            with self._lock:
+                data = self._data
+                if data is None or data[0] != version:
+                    data = self._data = (version, {})
+        return data[1]
+
+    def get(self, key, render):
+        """ Словарь {кодировка: байты} для `key`; при промахе тело
+        формирует `render`. None, если кэш заполнен.
+        """
+        responses = self._get_responses()
+        encodings = responses.get(key)
+        if encodings is None:
+            if len(responses) >= settings.INGREDIENT_RESPONSE_CACHE_SIZE:
+                return None
+            encodings = responses[key] = compress(render())
+        return encodings
+
+
+ingredient_index = IngredientPrefixIndex()
+ingredient_trigram_index = IngredientTrigramIndex()
+ingredient_responses = IngredientResponseCache()
@@ -0,0 +1,431 @@
+import random
+import re
+import time
+
+from django.contrib.postgres.search import TrigramSimilarity
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from django.contrib.auth.models import AnonymousUser
+from django.db import connection
+from django.db.models import Count, Prefetch, Q
+from django.http import QueryDict
+from drf_extra_fields.fields import Base64ImageField
+from rest_framework import serializers
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIRequestFactory
+
+from api.caches import get_memberships, ingredient_cache, tag_cache
+from api.filters import RecipeFilter
+from api.indexes import (ingredient_index, ingredient_responses,
+                         ingredient_trigram_index)
+from api.models import AmountIngredient, Ingredient, Recipe, Tag, User
+from api.serializers import (IngredientSerializer, ListRecipeSerializer,
+                             TagSerializer, UserSerializer)
+
+SUITES = {}
+
+
+def suite(name):
+    """ Регистрирует функцию замера под именем `name`."""
+
+    def decorator(func):
+        SUITES[name] = func
+        return func
+    return decorator
+
+
+def measure(func, arguments):
+    """ Вызывает `func` для каждого элемента `arguments` и возвращает
+    среднее время одного вызова в микросекундах.
+    """
+    start = time.perf_counter()
+    for argument in arguments:
+        func(argument)
+    return (time.perf_counter() - start) / len(arguments) * 1e6
+
+
+@suite('ingredient_prefix')
+def ingredient_prefix(command, options):
+    """ Поиск ингредиентов по началу названия: ORM против индекса."""
+    names = list(Ingredient.objects.values_list('name', flat=True))
+    if not names:
+        command.stderr.write('Нет ингредиентов для замера.')
+        return
+    random.seed(options['seed'])
+    prefixes = [
+        random.choice(names)[:random.randint(1, 3)]
+        for _ in range(options['repeat'])
+    ]
+    limit = options['limit']
+    ingredient_index.build()
+    results = {
+        'orm': measure(
+            lambda prefix: list(Ingredient.objects.filter(
+                name__istartswith=prefix
+            )[:limit]),
+            prefixes,
+        ),
+        'index': measure(
+            lambda prefix: ingredient_index.search(prefix, limit),
+            prefixes,
+        ),
+    }
+    for label, value in results.items():
+        command.stdout.write(f'{label:<10} {value:12.1f} мкс/запрос')
+    command.stdout.write(
+        f'ускорение   {results["orm"] / results["index"]:11.1f}x'
+    )
+
+
+@suite('ingredient_catalogue')
+def ingredient_catalogue(command, options):
+    """ Полный список ингредиентов и поиск по началу названия из одной-
+    двух букв: сериализация и JSON на каждый запрос против готовых
+    сжатых тел ответа. Тела обоих способов сравниваются.
+    """
+    names = list(Ingredient.objects.values_list('name', flat=True))
+    if not names:
+        command.stderr.write('Нет ингредиентов для замера.')
+        return
+    random.seed(options['seed'])
+    keys = ['all'] + [
+        f'name:{random.choice(names)[:random.randint(1, 2)].casefold()}'
+        for _ in range(options['repeat'] - 1)
+    ]
+    renderer = JSONRenderer()
+
+    def render(key):
+        if key == 'all':
+            ingredients = Ingredient.objects.all()
+        else:
+            ingredients = ingredient_index.search(key[len('name:'):])
+        return renderer.render(
+            IngredientSerializer(ingredients, many=True).data
+        )
+
+    ingredient_responses.invalidate()
+    mismatches = sum(
+        ingredient_responses.get(key, lambda: render(key))['identity']
+        != render(key)
+        for key in set(keys)
+    )
+    encodings = ingredient_responses.get('all', None)
+    for label, cases in (('полный', ['all'] * options['repeat']),
+                         ('префикс', keys[1:])):
+        results = {
+            'render': measure(render, cases),
+            'cached': measure(
+                lambda key: ingredient_responses.get(key, None)['gzip'],
+                cases,
+            ),
+        }
+        for name, value in results.items():
+            command.stdout.write(
+                f'{label:<8} {name:<8} {value:12.1f} мкс/запрос'
+            )
+        speedup = results['render'] / results['cached']
+        command.stdout.write(f'{label:<8} ускорение {speedup:10.1f}x')
+    for encoding, body in encodings.items():
+        command.stdout.write(f'{encoding:<10} {len(body):10} байт')
+    command.stdout.write(f'расхождений: {mismatches} из {len(set(keys))}')
+
+
+def misspell(name):
+    """ Вносит в название одну случайную опечатку."""
+    position = random.randrange(len(name))
+    return name[:position] + random.choice('аеиоуя') + name[position + 1:]
+
+
+@suite('ingredient_fuzzy')
+def ingredient_fuzzy(command, options):
+    """ Нечёткий поиск ингредиентов с опечатками: триграммный индекс
+    в памяти и pg_trgm, если база данных - PostgreSQL.
+    """
+    names = list(Ingredient.objects.values_list('name', flat=True))
+    if not names:
+        command.stderr.write('Нет ингредиентов для замера.')
+        return
+    random.seed(options['seed'])
+    queries = [
+        misspell(random.choice(names)) for _ in range(options['repeat'])
+    ]
+    limit = options['limit']
+    ingredient_trigram_index.build()
+    results = {
+        'index': measure(
+            lambda query: ingredient_trigram_index.search(query, limit),
+            queries,
+        ),
+    }
+    if connection.vendor == 'postgresql':
+        results['pg_trgm'] = measure(
+            lambda query: list(Ingredient.objects.filter(
+                name__trigram_similar=query
+            ).annotate(
+                similarity=TrigramSimilarity('name', query)
+            ).order_by('-similarity', 'name')[:limit]),
+            queries,
+        )
+    for label, value in results.items():
+        command.stdout.write(f'{label:<10} {value:12.1f} мкс/запрос')
+
+
+@suite('recipe_list')
+def recipe_list(command, options):
+    """ Выборка и сериализация страницы рецептов с тэгами
+    и ингредиентами из кэша справочников.
+    """
+    request = APIRequestFactory().get('/api/recipes/')
+    request.user = AnonymousUser()
+    context = {'request': request}
+    limit = options['limit']
+
+    def serialize(_):
+        recipes = Recipe.objects.with_related()[:limit]
+        return ListRecipeSerializer(recipes, many=True, context=context).data
+
+    serialize(None)
+    caches = {'tags': tag_cache, 'ingredients': ingredient_cache}
+    for cache in caches.values():
+        cache.hits = cache.misses = 0
+    value = measure(serialize, range(options['repeat']))
+    command.stdout.write(f'{"serializer":<10} {value:12.1f} мкс/страница')
+    for name, cache in caches.items():
+        stats = cache.stats()
+        command.stdout.write(
+            f'{name:<12} попаданий: {stats["hits"]}, '
+            f'промахов: {stats["misses"]}, объектов: {stats["size"]}'
+        )
+
+
+@suite('recipe_search')
+def recipe_search(command, options):
+    """ Поиск рецептов по словам из названий так, как его выполняет
+    список рецептов (количество и первая страница): полнотекстовый
+    индекс против поиска подстроки по названию и описанию.
+    """
+    names = list(Recipe.objects.order_by('?').values_list(
+        'name', flat=True
+    )[:1000])
+    words = [
+        word for name in names for word in re.findall(r'\w{4,}', name)
+    ]
+    if not words:
+        command.stderr.write('Нет рецептов для замера.')
+        return
+    random.seed(options['seed'])
+    queries = [random.choice(words) for _ in range(options['repeat'])]
+    limit = options['limit']
+
+    def page(queryset):
+        return queryset.count(), list(queryset[:limit])
+
+    results = {
+        'fulltext': measure(
+            lambda query: page(Recipe.objects.search(query)), queries
+        ),
+        'icontains': measure(
+            lambda query: page(Recipe.objects.filter(
+                Q(name__icontains=query) | Q(text__icontains=query)
+            )),
+            queries,
+        ),
+    }
+    command.stdout.write(f'рецептов: {Recipe.objects.count()}')
+    for label, value in results.items():
+        command.stdout.write(f'{label:<10} {value:12.1f} мкс/запрос')
+    command.stdout.write(
+        f'ускорение   {results["icontains"] / results["fulltext"]:11.1f}x'
+    )
+
+
+@suite('recipe_tags')
+def recipe_tags(command, options):
+    """ Фильтр рецептов по нескольким тэгам (любой из них и все сразу):
+    RecipeFilter с EXISTS против соединения с тэгами и DISTINCT.
+    Результаты обоих способов сравниваются.
+    """
+    slugs = list(Tag.objects.values_list('slug', flat=True))
+    if not slugs:
+        command.stderr.write('Нет тэгов для замера.')
+        return
+    random.seed(options['seed'])
+    cases = [
+        (random.choice(('any', 'all')),
+         random.sample(slugs, random.randint(1, min(3, len(slugs)))))
+        for _ in range(options['repeat'])
+    ]
+    limit = options['limit']
+
+    def page(queryset):
+        return queryset.count(), list(
+            queryset.values_list('id', flat=True)[:limit]
+        )
+
+    def joined(case):
+        mode, selected = case
+        # Прежний фильтр: выбор допустимых слагов и соединение.
+        list(Recipe.tags.through.objects.values_list(
+            'tag__slug', flat=True
+        ).distinct())
+        queryset = Recipe.objects.all()
+        if mode == 'all':
+            for slug in selected:
+                queryset = queryset.filter(tags__slug=slug)
+        else:
+            queryset = queryset.filter(tags__slug__in=selected).distinct()
+        return page(queryset)
+
+    def exists(case):
+        mode, selected = case
+        data = QueryDict(mutable=True)
+        data.setlist('tags', selected)
+        data['tags_mode'] = mode
+        return page(RecipeFilter(data, Recipe.objects.all()).qs)
+
+    mismatches = sum(joined(case) != exists(case) for case in cases)
+    results = {
+        'join': measure(joined, cases),
+        'exists': measure(exists, cases),
+    }
+    for label, value in results.items():
+        command.stdout.write(f'{label:<10} {value:12.1f} мкс/запрос')
+    command.stdout.write(
+        f'ускорение   {results["join"] / results["exists"]:11.1f}x'
+    )
+    command.stdout.write(f'расхождений: {mismatches} из {len(cases)}')
+
+
+class ReferenceAmountSerializer(serializers.ModelSerializer):
+    id = serializers.PrimaryKeyRelatedField(read_only=True,
+                                            source='ingredient')
+    name = serializers.ReadOnlyField(source='ingredient.name')
+    measurement_unit = serializers.ReadOnlyField(
+        source='ingredient.measurement_unit'
+    )
+
+    class Meta:
+        model = AmountIngredient
+        fields = ('id', 'name', 'measurement_unit', 'amount')
+
+
+class ReferenceRecipeSerializer(serializers.ModelSerializer):
+    """ Эталон для recipe_fast: сериализатор рецептов на полях DRF
+    в том виде, что был до быстрого представления, с добавленными
+    позже ссылками на уменьшенные копии изображения. Признаки
+    избранного, покупок и подписок берутся из тех же множеств
+    пользователя, что и у быстрого представления.
+    """
+
+    image = Base64ImageField(max_length=None, use_url=True)
+    tags = TagSerializer(read_only=True, many=True)
+    author = UserSerializer(read_only=True)
+    ingredients = ReferenceAmountSerializer(
+        source='ingredient_amounts', many=True, read_only=True,
+    )
+    is_favorited = serializers.SerializerMethodField()
+    is_in_shopping_cart = serializers.SerializerMethodField()
+    image_variants = serializers.SerializerMethodField()
+
+    class Meta:
+        model = Recipe
+        fields = ('id', 'tags', 'author', 'ingredients', 'is_favorited',
+                  'is_in_shopping_cart', 'name', 'image', 'image_variants',
+                  'text', 'cooking_time')
+
+    def get_is_favorited(self, obj):
+        request = self.context['request']
+        return (request.user.is_authenticated
+                and obj.id in get_memberships(request).favorites)
+
+    def get_is_in_shopping_cart(self, obj):
+        request = self.context['request']
+        return (request.user.is_authenticated
+                and obj.id in get_memberships(request).purchases)
+
+    def get_image_variants(self, obj):
+        request = self.context['request']
+        return {
+            name: request.build_absolute_uri(default_storage.url(path))
+            for name, path in obj.image_variants.items()
+        }
+
+
+@suite('recipe_fast')
+def recipe_fast(command, options):
+    """ Сериализация загруженных страниц рецептов в JSON: быстрое
+    представление ListRecipeSerializer против прежнего сериализатора
+    на полях DRF (ReferenceRecipeSerializer). Страницы загружаются
+    заранее, так что запросы к базе в замер не входят; ответы обоих
+    способов сравниваются побайтно. Запрос выполняет пользователь
+    с наибольшим числом избранных рецептов.
+    """
+    total = Recipe.objects.count()
+    if not total:
+        command.stderr.write('Нет рецептов для замера.')
+        return
+    limit = options['limit']
+    request = APIRequestFactory().get('/api/recipes/')
+    request.user = User.objects.annotate(
+        favorites_total=Count('favorite_subscriber')
+    ).order_by('-favorites_total').first()
+    context = {'request': request}
+    random.seed(options['seed'])
+    # Эталону нужны тэги и ингредиенты целиком, а не только ключи,
+    # которые выбирает with_related.
+    reference = Recipe.objects.select_related('author').prefetch_related(
+        'tags', Prefetch(
+            'ingredient_amounts',
+            queryset=AmountIngredient.objects.select_related(
+                'ingredient'
+            ).order_by('id'),
+        ),
+    )
+    offsets = [
+        random.randrange(max(total - limit, 1))
+        for _ in range(min(options['repeat'], 50))
+    ]
+    pages = [
+        (list(Recipe.objects.with_related()[offset:offset + limit]),
+         list(reference[offset:offset + limit]))
+        for offset in offsets
+    ]
+    pages = [pages[i % len(pages)] for i in range(options['repeat'])]
+    renderer = JSONRenderer()
+
+    def fast(pair):
+        return renderer.render(
+            ListRecipeSerializer(pair[0], many=True, context=context).data
+        )
+
+    def fields(pair):
+        return renderer.render(ReferenceRecipeSerializer(
+            pair[1], many=True, context=context
+        ).data)
+
+    mismatches = sum(fast(page) != fields(page) for page in pages)
+    results = {
+        'fields': measure(fields, pages),
+        'fast': measure(fast, pages),
+    }
+    for label, value in results.items():
+        command.stdout.write(f'{label:<10} {value:12.1f} мкс/страница')
+    command.stdout.write(
+        f'ускорение   {results["fields"] / results["fast"]:11.1f}x'
+    )
+    command.stdout.write(f'расхождений: {mismatches} из {len(pages)}')
+
+
+class Command(BaseCommand):
+    help = 'Замеры производительности отдельных участков API.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('suite', choices=sorted(SUITES))
+        parser.add_argument('--repeat', type=int, default=1000)
+        parser.add_argument('--limit', type=int, default=20)
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        self.stdout.write(f'Замер {options["suite"]}, '
+                          f'повторов: {options["repeat"]}')
+        SUITES[options['suite']](self, options)
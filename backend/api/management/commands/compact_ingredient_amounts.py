@@ -0,0 +1,31 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from api.models import AmountIngredient
+
+
+class Command(BaseCommand):
+    help = ('Удаляет записи AmountIngredient без рецепта, оставшиеся '
+            'от общих количеств ингредиентов.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=10000)
+
+    def handle(self, *args, **options):
+        orphans = AmountIngredient.objects.filter(recipe__isnull=True)
+        deleted = 0
+        start = time.perf_counter()
+        while True:
+            ids = list(
+                orphans.order_by('id').values_list('id', flat=True)[
+                    :options['batch_size']
+                ]
+            )
+            if not ids:
+                break
+            deleted += AmountIngredient.objects.filter(id__in=ids).delete()[0]
+        elapsed = time.perf_counter() - start
+        self.stdout.write(self.style.SUCCESS(
+            f'Удалено записей: {deleted} за {elapsed:.1f} с.'
+        ))
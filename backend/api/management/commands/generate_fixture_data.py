@@ -0,0 +1,340 @@
+import random
+import time
+from collections import Counter, deque
+from contextlib import contextmanager
+from datetime import timedelta
+from io import BytesIO
+from itertools import accumulate
+
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.core.management.color import no_style
+from django.db import connection, transaction
+from django.db.models import Max
+from django.utils import timezone
+from PIL import Image
+
+from api.management.utils import chunked
+from api.models import (AmountIngredient, ContentVersion, Favorite, Follow,
+                        Ingredient, Purchase, Recipe, Tag, TimelineEntry,
+                        User)
+
+from .load_ingredients import DEFAULT_PATH
+
+TAGS = (
+    ('Завтрак', '#E26C2D', 'breakfast'),
+    ('Обед', '#49B64E', 'lunch'),
+    ('Ужин', '#8775D2', 'dinner'),
+    ('Выпечка', '#D2B48C', 'baking'),
+    ('Вегетарианское', '#2E8B57', 'vegetarian'),
+)
+DISHES = (
+    'Салат', 'Суп', 'Рагу', 'Запеканка', 'Омлет', 'Паста', 'Пирог',
+    'Каша', 'Плов', 'Котлеты', 'Блины', 'Соус',
+)
+FIRST_NAMES = ('Анна', 'Иван', 'Мария', 'Пётр', 'Ольга', 'Дмитрий')
+LAST_NAMES = ('Иванова', 'Петров', 'Смирнова', 'Кузнецов', 'Попова')
+IMAGE_COLORS = ('#E26C2D', '#49B64E', '#8775D2', '#D2B48C', '#2E8B57')
+
+
+def popularity(size, exponent=1.0):
+    """ Случайный порядок `size` объектов и накопленные веса по закону
+    Ципфа: первые в порядке объекты выбираются намного чаще остальных.
+    """
+    order = list(range(size))
+    random.shuffle(order)
+    weights = list(accumulate(
+        1 / (rank + 1) ** exponent for rank in range(size)
+    ))
+    return order, weights
+
+
+def sample_popular(order, weights, count, exclude=None):
+    """ До `count` разных объектов с учётом популярности."""
+    count = min(count, len(order) - (exclude is not None))
+    chosen = set()
+    for _ in range(count * 20):
+        if len(chosen) >= count:
+            break
+        chosen.update(
+            item for item in random.choices(
+                order, cum_weights=weights, k=count - len(chosen)
+            ) if item != exclude
+        )
+    return chosen
+
+
+@contextmanager
+def explicit_dates(model):
+    """ Временно отключает auto_now и auto_now_add у полей модели,
+    чтобы bulk_create сохранил заданные даты.
+    """
+    fields = [
+        field for field in model._meta.concrete_fields
+        if getattr(field, 'auto_now', False)
+        or getattr(field, 'auto_now_add', False)
+    ]
+    saved = [(field, field.auto_now, field.auto_now_add) for field in fields]
+    for field in fields:
+        field.auto_now = field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field, auto_now, auto_now_add in saved:
+            field.auto_now, field.auto_now_add = auto_now, auto_now_add
+
+
+class Command(BaseCommand):
+    help = ('Создаёт тестовые данные для нагрузочного тестирования: '
+            'пользователей, рецепты с ингредиентами из каталога, подписки, '
+            'избранное и списки покупок. При одинаковом --seed данные '
+            'повторяются.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--recipes', type=int, default=10000)
+        parser.add_argument('--follows', type=int, default=30,
+                            help='Максимум подписок одного пользователя.')
+        parser.add_argument('--favorites', type=int, default=50,
+                            help='Максимум избранных рецептов.')
+        parser.add_argument('--cart', type=int, default=10,
+                            help='Максимум рецептов в списке покупок.')
+        parser.add_argument('--days', type=int, default=365,
+                            help='За сколько дней публикуются рецепты.')
+        parser.add_argument('--ingredients', default=DEFAULT_PATH,
+                            help='Каталог ингредиентов для загрузки.')
+        parser.add_argument('--prefix', default='fixture')
+        parser.add_argument('--password', default='fixture-password')
+        parser.add_argument('--batch-size', type=int, default=2000)
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        prefix = options['prefix']
+        if User.objects.filter(username__startswith=prefix).exists():
+            raise CommandError(
+                f'Пользователи {prefix}* уже есть: тестовые данные '
+                'создаются в пустой базе или с другим --prefix.'
+            )
+        if options['users'] < 2 or options['recipes'] < 1:
+            raise CommandError('Нужно хотя бы 2 пользователя и 1 рецепт.')
+        random.seed(options['seed'])
+        start = time.perf_counter()
+        call_command(
+            'load_ingredients', options['ingredients'], stdout=self.stdout
+        )
+        self.ingredient_names = dict(
+            Ingredient.objects.order_by('id').values_list('id', 'name')
+        )
+        self.ingredient_ids = list(self.ingredient_names)
+        self.tag_ids = self.get_tags()
+        self.images = self.get_images()
+        plan = self.plan(options)
+        self.create_users(plan, options)
+        self.create_recipes(plan, options)
+        self.create_relations(plan, options)
+        self.create_timelines(plan, options)
+        with connection.cursor() as cursor:
+            for sql in connection.ops.sequence_reset_sql(
+                no_style(), [User, Recipe]
+            ):
+                cursor.execute(sql)
+        ContentVersion.objects.bump('tags', 'recipes', 'users')
+        self.stdout.write(self.style.SUCCESS(
+            f'Пользователей: {options["users"]}, рецептов: '
+            f'{options["recipes"]}, подписок: {len(plan["follows"])}, '
+            f'избранного: {len(plan["favorites"])}, покупок: '
+            f'{len(plan["purchases"])} за '
+            f'{time.perf_counter() - start:.1f} с.'
+        ))
+
+    def get_tags(self):
+        if not Tag.objects.exists():
+            Tag.objects.bulk_create(
+                Tag(name=name, color=color, slug=slug)
+                for name, color, slug in TAGS
+            )
+        return list(Tag.objects.order_by('id').values_list('id', flat=True))
+
+    def get_images(self):
+        """ Несколько небольших изображений: хранилище сохраняет каждое
+        один раз, сколько бы рецептов на него ни ссылалось.
+        """
+        names = []
+        for color in IMAGE_COLORS:
+            buffer = BytesIO()
+            Image.new('RGB', (64, 64), color).save(buffer, 'PNG')
+            names.append(default_storage.save(
+                'recipes/fixture.png', ContentFile(buffer.getvalue())
+            ))
+        return names
+
+    def plan(self, options):
+        """ Заранее выбирает авторов рецептов, подписки, избранное
+        и покупки, чтобы сразу записать в базу значения счётчиков.
+        """
+        users, recipes = options['users'], options['recipes']
+        authors_order, authors_weights = popularity(users)
+        authors = random.choices(
+            authors_order, cum_weights=authors_weights, k=recipes
+        )
+        follows = [
+            (user, author)
+            for user in range(users)
+            for author in sorted(sample_popular(
+                authors_order, authors_weights,
+                random.randint(0, options['follows']), exclude=user
+            ))
+        ]
+        recipes_order, recipes_weights = popularity(recipes)
+        favorites, purchases = [], []
+        for user in range(users):
+            for target, limit in ((favorites, options['favorites']),
+                                  (purchases, options['cart'])):
+                target.extend(
+                    (user, recipe) for recipe in sorted(sample_popular(
+                        recipes_order, recipes_weights,
+                        random.randint(0, limit)
+                    ))
+                )
+        return {
+            'authors': authors,
+            'follows': follows,
+            'favorites': favorites,
+            'purchases': purchases,
+            'recipes_count': Counter(authors),
+            'followers_count': Counter(author for _, author in follows),
+            'favorites_count': Counter(recipe for _, recipe in favorites),
+            'in_carts_count': Counter(recipe for _, recipe in purchases),
+        }
+
+    def create_users(self, plan, options):
+        self.first_user_id = (
+            User.objects.aggregate(last=Max('id'))['last'] or 0
+        ) + 1
+        password = make_password(options['password'])
+        prefix = options['prefix']
+        users = (
+            User(
+                id=self.first_user_id + index,
+                username=f'{prefix}{index}',
+                email=f'{prefix}{index}@example.com',
+                password=password,
+                first_name=random.choice(FIRST_NAMES),
+                last_name=random.choice(LAST_NAMES),
+                recipes_count=plan['recipes_count'][index],
+                followers_count=plan['followers_count'][index],
+            )
+            for index in range(options['users'])
+        )
+        for chunk in chunked(users, options['batch_size']):
+            with transaction.atomic():
+                User.objects.bulk_create(chunk)
+
+    def create_recipes(self, plan, options):
+        """ Рецепты с ингредиентами и тэгами. Даты публикации растут
+        вместе с id и равномерно покрывают последние --days дней.
+        """
+        self.first_recipe_id = (
+            Recipe.objects.aggregate(last=Max('id'))['last'] or 0
+        ) + 1
+        # Последние рецепты каждого автора для лент подписчиков.
+        self.latest = {}
+        now = timezone.now()
+        span = timedelta(days=options['days'])
+        total = options['recipes']
+        links = Recipe.tags.through
+        for chunk in chunked(range(total), options['batch_size']):
+            recipes, amounts, tags = [], [], []
+            for index in chunk:
+                recipe_id = self.first_recipe_id + index
+                author = plan['authors'][index]
+                pub_date = (
+                    now - span + span * (index + random.random()) / total
+                )
+                ingredients = random.sample(
+                    self.ingredient_ids,
+                    min(random.randint(3, 10), len(self.ingredient_ids))
+                )
+                recipes.append(Recipe(
+                    id=recipe_id,
+                    author_id=self.first_user_id + author,
+                    name=self.recipe_name(ingredients),
+                    image=random.choice(self.images),
+                    text=self.recipe_text(ingredients),
+                    cooking_time=random.randint(5, 180),
+                    pub_date=pub_date,
+                    updated_at=pub_date,
+                    favorites_count=plan['favorites_count'][index],
+                    in_carts_count=plan['in_carts_count'][index],
+                ))
+                amounts.extend(
+                    AmountIngredient(
+                        recipe_id=recipe_id, ingredient_id=ingredient,
+                        amount=random.randint(1, 500)
+                    )
+                    for ingredient in ingredients
+                )
+                tags.extend(
+                    links(recipe_id=recipe_id, tag_id=tag)
+                    for tag in random.sample(
+                        self.tag_ids,
+                        random.randint(1, min(3, len(self.tag_ids)))
+                    )
+                )
+                self.latest.setdefault(
+                    author, deque(maxlen=settings.FEED_BACKFILL_SIZE)
+                ).append((recipe_id, pub_date))
+            with transaction.atomic(), explicit_dates(Recipe):
+                Recipe.objects.bulk_create(recipes)
+                AmountIngredient.objects.bulk_create(amounts)
+                links.objects.bulk_create(tags)
+
+    def recipe_name(self, ingredients):
+        return (f'{random.choice(DISHES)}: '
+                f'{self.ingredient_names[ingredients[0]]}')[:200]
+
+    def recipe_text(self, ingredients):
+        names = ', '.join(
+            self.ingredient_names[ingredient] for ingredient in ingredients
+        )
+        return (f'Подготовьте ингредиенты: {names}. '
+                f'{random.choice(DISHES)} готовится по шагам, '
+                'подавать горячим.')
+
+    def create_relations(self, plan, options):
+        first_user, first_recipe = self.first_user_id, self.first_recipe_id
+        relations = (
+            (Follow, 'author_id', first_user, plan['follows']),
+            (Favorite, 'recipe_id', first_recipe, plan['favorites']),
+            (Purchase, 'recipe_id', first_recipe, plan['purchases']),
+        )
+        for model, field, first, pairs in relations:
+            objects = (
+                model(user_id=first_user + user, **{field: first + target})
+                for user, target in pairs
+            )
+            for chunk in chunked(objects, options['batch_size']):
+                with transaction.atomic():
+                    model.objects.bulk_create(chunk)
+
+    def create_timelines(self, plan, options):
+        """ Ленты подписок так же, как их заполняет подписка на автора:
+        последние рецепты авторов, у которых подписчиков не больше
+        settings.FEED_FANOUT_LIMIT.
+        """
+        entries = (
+            TimelineEntry(
+                user_id=self.first_user_id + user, recipe_id=recipe_id,
+                author_id=self.first_user_id + author, pub_date=pub_date
+            )
+            for user, author in plan['follows']
+            if plan['followers_count'][author] <= settings.FEED_FANOUT_LIMIT
+            for recipe_id, pub_date in self.latest.get(author, ())
+        )
+        for chunk in chunked(entries, options['batch_size']):
+            with transaction.atomic():
+                TimelineEntry.objects.bulk_create(chunk)
@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand
+
+from api.images import save_variants
+from api.models import Recipe
+
+
+class Command(BaseCommand):
+    help = ('Создаёт уменьшенные копии изображений рецептов, у которых '
+            'их ещё нет (например, загруженных до появления обработки).')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--all', action='store_true',
+            help='Пересоздать копии для всех рецептов.'
+        )
+
+    def handle(self, *args, **options):
+        recipes = Recipe.objects.exclude(image='')
+        if not options['all']:
+            recipes = recipes.filter(image_variants={})
+        processed = 0
+        for recipe_id, name in recipes.values_list('id', 'image').iterator():
+            # Не process_recipe_image: она закрывает подключение,
+            # а серверный курсор iterator() ещё открыт.
+            try:
+                save_variants(recipe_id, name)
+            except Exception as error:
+                self.stderr.write(f'{name}: {error}')
+                continue
+            processed += 1
+        self.stdout.write(self.style.SUCCESS(
+            f'Обработано изображений: {processed}.'
+        ))
@@ -0,0 +1,135 @@
+import csv
+import io
+import json
+import os
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from api.management.utils import chunked
+from api.models import ContentVersion, Ingredient
+
+DEFAULT_PATH = os.path.join(
+    os.path.dirname(settings.BASE_DIR), 'data', 'ingredients.csv'
+)
+
+
+def read_csv(file):
+    for row in csv.reader(file):
+        if row:
+            yield row[0].strip(), row[1].strip()
+
+
+def read_json(file, buffer_size=64 * 1024):
+    """ Читает JSON-массив объектов по частям, не загружая файл целиком."""
+    decoder = json.JSONDecoder()
+    buffer = ''
+    position = 0
+    started = False
+    while True:
+        chunk = file.read(buffer_size)
+        buffer = buffer[position:] + chunk
+        position = 0
+        while True:
+            while position < len(buffer) and buffer[position] in ' \t\r\n,':
+                position += 1
+            if not started:
+                if position == len(buffer):
+                    break
+                if buffer[position] != '[':
+                    raise CommandError('Ожидался JSON-массив ингредиентов.')
+                started = True
+                position += 1
+                continue
+            if position < len(buffer) and buffer[position] == ']':
+                return
+            try:
+                item, position = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                if not chunk:
+                    raise CommandError('Некорректный JSON.')
+                break
+            yield item['name'].strip(), item['measurement_unit'].strip()
+        if not chunk:
+            return
+
+
+READERS = {
+    'csv': read_csv,
+    'json': read_json,
+}
+
+
+class Command(BaseCommand):
+    help = ('Загружает каталог ингредиентов из CSV или JSON. '
+            'Повторный запуск не создаёт дублей.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', nargs='?', default=DEFAULT_PATH)
+        parser.add_argument('--format', choices=sorted(READERS))
+        parser.add_argument('--chunk-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        path = options['path']
+        file_format = (
+            options['format'] or os.path.splitext(path)[1].lstrip('.')
+        )
+        if file_format not in READERS:
+            raise CommandError(
+                f'Неизвестный формат файла: {file_format or path}.'
+            )
+        load_chunk = (
+            self.copy_chunk if connection.vendor == 'postgresql'
+            else self.bulk_create_chunk
+        )
+        count_before = Ingredient.objects.count()
+        total = 0
+        start = time.perf_counter()
+        with open(path, encoding='utf-8') as file:
+            rows = READERS[file_format](file)
+            for chunk in chunked(rows, options['chunk_size']):
+                load_chunk(chunk)
+                total += len(chunk)
+        elapsed = time.perf_counter() - start
+        created = Ingredient.objects.count() - count_before
+        if created:
+            ContentVersion.objects.bump('ingredients')
+        self.stdout.write(self.style.SUCCESS(
+            f'Обработано строк: {total}, добавлено ингредиентов: {created}, '
+            f'{total / elapsed:.0f} строк/с.'
+        ))
+
+    def bulk_create_chunk(self, chunk):
+        Ingredient.objects.bulk_create(
+            [Ingredient(name=name, measurement_unit=measurement_unit)
+             for name, measurement_unit in chunk],
+            ignore_conflicts=True,
+        )
+
+    @transaction.atomic
+    def copy_chunk(self, chunk):
+        """ Загрузка через COPY во временную таблицу и INSERT ... ON CONFLICT
+        по паре (name, measurement_unit).
+        """
+        table = Ingredient._meta.db_table
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows(chunk)
+        buffer.seek(0)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'CREATE TEMPORARY TABLE IF NOT EXISTS ingredient_load '
+                '(name varchar(200), measurement_unit varchar(200)) '
+                'ON COMMIT DELETE ROWS'
+            )
+            cursor.copy_expert(
+                'COPY ingredient_load (name, measurement_unit) '
+                'FROM STDIN WITH (FORMAT csv)',
+                buffer,
+            )
+            cursor.execute(
+                f'INSERT INTO {table} (name, measurement_unit) '
+                'SELECT DISTINCT name, measurement_unit FROM ingredient_load '
+                'ON CONFLICT (name, measurement_unit) DO NOTHING'
+            )
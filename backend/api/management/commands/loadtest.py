@@ -0,0 +1,198 @@
+import random
+import re
+import threading
+import time
+from collections import defaultdict
+from statistics import mean, quantiles
+
+import requests
+from django.core.management.base import BaseCommand, CommandError
+
+SCENARIOS = {}
+
+
+def scenario(name, weight):
+    """ Регистрирует сценарий `name`; `weight` - его доля в общей смеси."""
+
+    def decorator(func):
+        SCENARIOS[name] = (func, weight)
+        return func
+    return decorator
+
+
+@scenario('recipe_list', 4)
+def recipe_list(data, rng):
+    return f'/api/recipes/?page={rng.randint(1, 20)}&limit=6'
+
+
+@scenario('recipe_filters', 3)
+def recipe_filters(data, rng):
+    kind = rng.choice(('tags', 'author', 'search'))
+    if kind == 'tags':
+        tags = rng.sample(data['tags'], rng.randint(1, min(2, len(
+            data['tags']
+        ))))
+        mode = rng.choice(('any', 'all'))
+        query = '&'.join(f'tags={slug}' for slug in tags)
+        return f'/api/recipes/?{query}&tags_mode={mode}&limit=6'
+    if kind == 'author':
+        return f'/api/recipes/?author={rng.choice(data["authors"])}&limit=6'
+    return f'/api/recipes/?search={rng.choice(data["words"])}&limit=6'
+
+
+@scenario('subscriptions', 2)
+def subscriptions(data, rng):
+    return '/api/users/subscriptions/?recipes_limit=3&limit=6'
+
+
+@scenario('shopping_cart', 1)
+def shopping_cart(data, rng):
+    return '/api/recipes/download_shopping_cart/?format=txt'
+
+
+@scenario('ingredient_search', 3)
+def ingredient_search(data, rng):
+    name = rng.choice(data['ingredients'])
+    return f'/api/ingredients/?name={name[:rng.randint(1, 3)]}'
+
+
+def percentile(values, percent):
+    if len(values) < 2:
+        return values[0] if values else 0.0
+    return quantiles(values, n=100, method='inclusive')[percent - 1]
+
+
+class Command(BaseCommand):
+    help = ('Нагрузочное тестирование запущенного сервера: рецепты и '
+            'фильтры, подписки, список покупок, поиск ингредиентов. '
+            'Выводит p50/p95/p99, пропускную способность и число '
+            'SQL-запросов на запрос (нужен QUERY_COUNT_HEADER=1 '
+            'на сервере). Пользователей создаёт generate_fixture_data.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', default='http://127.0.0.1:8000')
+        parser.add_argument('--duration', type=float, default=30,
+                            help='Длительность замера в секундах.')
+        parser.add_argument('--concurrency', type=int, default=8)
+        parser.add_argument('--accounts', type=int, default=8,
+                            help='Сколько тестовых пользователей войдёт.')
+        parser.add_argument('--prefix', default='fixture')
+        parser.add_argument('--password', default='fixture-password')
+        parser.add_argument('--scenario', action='append',
+                            choices=sorted(SCENARIOS),
+                            help='Только указанные сценарии.')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        self.url = options['url'].rstrip('/')
+        tokens = self.login(options)
+        data = self.discover(tokens[0])
+        names = options['scenario'] or sorted(SCENARIOS)
+        weights = [SCENARIOS[name][1] for name in names]
+        results = defaultdict(list)
+        lock = threading.Lock()
+        deadline = time.monotonic() + options['duration']
+
+        def worker(number):
+            rng = random.Random(options['seed'] + number)
+            session = requests.Session()
+            session.headers['Authorization'] = (
+                f'Token {tokens[number % len(tokens)]}'
+            )
+            while time.monotonic() < deadline:
+                name = rng.choices(names, weights=weights)[0]
+                path = SCENARIOS[name][0](data, rng)
+                start = time.perf_counter()
+                response = session.get(self.url + path)
+                response.content
+                elapsed = time.perf_counter() - start
+                queries = response.headers.get('X-DB-Queries')
+                with lock:
+                    results[name].append((
+                        elapsed, response.status_code,
+                        int(queries) if queries is not None else None,
+                    ))
+
+        self.stdout.write(
+            f'Замер {options["duration"]:.0f} с, потоков: '
+            f'{options["concurrency"]}, сценарии: {", ".join(names)}'
+        )
+        started = time.monotonic()
+        threads = [
+            threading.Thread(target=worker, args=(number,))
+            for number in range(options['concurrency'])
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.report(results, time.monotonic() - started)
+
+    def login(self, options):
+        """ Получает токены тестовых пользователей."""
+        tokens = []
+        for index in range(options['accounts']):
+            response = requests.post(
+                f'{self.url}/api/auth/token/login/',
+                json={
+                    'email': f'{options["prefix"]}{index}@example.com',
+                    'password': options['password'],
+                },
+            )
+            if response.status_code == 200:
+                tokens.append(response.json()['auth_token'])
+        if not tokens:
+            raise CommandError(
+                'Не удалось войти ни одним тестовым пользователем: '
+                'создайте их командой generate_fixture_data.'
+            )
+        return tokens
+
+    def discover(self, token):
+        """ Тэги, авторы, слова из названий рецептов и ингредиенты
+        для параметров запросов.
+        """
+        session = requests.Session()
+        session.headers['Authorization'] = f'Token {token}'
+        recipes = session.get(
+            f'{self.url}/api/recipes/?limit=100'
+        ).json()['results']
+        data = {
+            'tags': [tag['slug'] for tag in session.get(
+                f'{self.url}/api/tags/'
+            ).json()],
+            'authors': sorted({recipe['author']['id'] for recipe in recipes}),
+            'words': sorted({
+                word.lower() for recipe in recipes
+                for word in re.findall(r'\w{4,}', recipe['name'])
+            }),
+            'ingredients': [ingredient['name'] for ingredient in session.get(
+                f'{self.url}/api/ingredients/'
+            ).json()],
+        }
+        if not all(data.values()):
+            raise CommandError('На сервере нет данных для замера.')
+        return data
+
+    def report(self, results, elapsed):
+        header = (f'{"сценарий":<18} {"запросов":>8} {"ошибок":>6} '
+                  f'{"rps":>7} {"p50 мс":>8} {"p95 мс":>8} {"p99 мс":>8} '
+                  f'{"SQL":>5}')
+        self.stdout.write(header)
+        total = []
+        for name in sorted(results):
+            rows = results[name]
+            total.extend(rows)
+            self.stdout.write(self.format_row(name, rows, elapsed))
+        self.stdout.write(self.format_row('всего', total, elapsed))
+
+    def format_row(self, name, rows, elapsed):
+        latencies = [row[0] * 1000 for row in rows]
+        errors = sum(row[1] >= 400 for row in rows)
+        queries = [row[2] for row in rows if row[2] is not None]
+        sql = f'{mean(queries):5.1f}' if queries else f'{"-":>5}'
+        return (f'{name:<18} {len(rows):>8} {errors:>6} '
+                f'{len(rows) / elapsed:>7.1f} '
+                f'{percentile(latencies, 50):>8.1f} '
+                f'{percentile(latencies, 95):>8.1f} '
+                f'{percentile(latencies, 99):>8.1f} {sql}')
@@ -0,0 +1,84 @@
+import os
+import time
+from datetime import timedelta
+
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from api.management.utils import chunked
+from api.models import Recipe
+
+
+def walk(storage, directory):
+    """ Обходит каталог хранилища, по одному подкаталогу за раз."""
+    directories, files = storage.listdir(directory)
+    for name in files:
+        yield os.path.join(directory, name)
+    for name in directories:
+        yield from walk(storage, os.path.join(directory, name))
+
+
+def get_referenced_images(names):
+    """ Возвращает те из `names`, которые служат изображениями рецептов."""
+    return set(Recipe.objects.filter(image__in=names).values_list(
+        'image', flat=True
+    ))
+
+
+def get_referenced_variants():
+    """ Все уменьшенные копии, на которые ссылаются рецепты, по всем
+    ключам `image_variants` - в том числе по ширинам, которых уже нет
+    в settings.IMAGE_VARIANT_WIDTHS.
+    """
+    referenced = set()
+    for variants in Recipe.objects.exclude(image_variants={}).values_list(
+        'image_variants', flat=True
+    ).iterator():
+        referenced.update(variants.values())
+    return referenced
+
+
+class Command(BaseCommand):
+    help = ('Удаляет файлы изображений рецептов, на которые не ссылается '
+            'ни один рецепт, и сообщает объём освобождённого места.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--path', default='recipes')
+        parser.add_argument('--chunk-size', type=int, default=1000)
+        parser.add_argument(
+            '--min-age', type=int, default=3600,
+            help='Не трогать файлы моложе указанного числа секунд: '
+                 'они могут принадлежать ещё не сохранённым рецептам.'
+        )
+        parser.add_argument('--dry-run', action='store_true')
+
+    def handle(self, *args, **options):
+        storage = default_storage
+        cutoff = timezone.now() - timedelta(seconds=options['min_age'])
+        checked = deleted = reclaimed = 0
+        start = time.perf_counter()
+        files = (
+            walk(storage, options['path'])
+            if storage.exists(options['path']) else ()
+        )
+        variants = get_referenced_variants()
+        for chunk in chunked(files, options['chunk_size']):
+            checked += len(chunk)
+            images = get_referenced_images(chunk)
+            for name in chunk:
+                if name in images or name in variants:
+                    continue
+                if storage.get_modified_time(name) > cutoff:
+                    continue
+                size = storage.size(name)
+                if not options['dry_run']:
+                    storage.delete(name)
+                deleted += 1
+                reclaimed += size
+        elapsed = time.perf_counter() - start
+        action = 'Можно удалить' if options['dry_run'] else 'Удалено'
+        self.stdout.write(self.style.SUCCESS(
+            f'Проверено файлов: {checked}. {action} файлов: {deleted}, '
+            f'освобождено байт: {reclaimed} за {elapsed:.1f} с.'
+        ))
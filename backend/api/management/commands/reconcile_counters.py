@@ -0,0 +1,82 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db.models import Count, F, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce
+
+from api.models import Favorite, Follow, Purchase, Recipe, User
+
+
+def count_subquery(model, field):
+    """ Количество строк `model`, ссылающихся полем `field` на объект."""
+    return Coalesce(Subquery(
+        model.objects.filter(**{field: OuterRef('pk')}).order_by().values(
+            field
+        ).annotate(total=Count('pk')).values('total')
+    ), 0)
+
+
+# Модель -> {поле-счётчик: (модель связи, поле ссылки)}.
+COUNTERS = {
+    Recipe: {
+        'favorites_count': (Favorite, 'recipe'),
+        'in_carts_count': (Purchase, 'recipe'),
+    },
+    User: {
+        'recipes_count': (Recipe, 'author'),
+        'followers_count': (Follow, 'author'),
+    },
+}
+
+
+class Command(BaseCommand):
+    help = ('Пересчитывает счётчики избранного, списков покупок, рецептов '
+            'и подписчиков авторов и исправляет расхождения.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        for model, counters in COUNTERS.items():
+            fixed = self.reconcile(model, counters, options['batch_size'])
+            self.stdout.write(
+                f'{model._meta.verbose_name_plural}: исправлено {fixed}.'
+            )
+        self.stdout.write(self.style.SUCCESS(
+            f'Готово за {time.perf_counter() - start:.1f} с.'
+        ))
+
+    def reconcile(self, model, counters, batch_size):
+        """ Проходит объекты пачками по первичному ключу и у объектов
+        с расхождением пересчитывает счётчики одним UPDATE с подзапросом:
+        подсчёт и запись выполняются одной командой, поэтому
+        параллельные изменения счётчиков не теряются.
+        """
+        actual = {
+            field: count_subquery(*source)
+            for field, source in counters.items()
+        }
+        drift = Q()
+        for field in counters:
+            drift |= ~Q(**{field: F(f'actual_{field}')})
+        fixed = 0
+        last_id = 0
+        while True:
+            ids = list(
+                model.objects.filter(pk__gt=last_id).order_by(
+                    'pk'
+                ).values_list('pk', flat=True)[:batch_size]
+            )
+            if not ids:
+                return fixed
+            last_id = ids[-1]
+            drifted = list(
+                model.objects.filter(pk__in=ids).annotate(**{
+                    f'actual_{field}': subquery
+                    for field, subquery in actual.items()
+                }).filter(drift).values_list('pk', flat=True)
+            )
+            if drifted:
+                model.objects.filter(pk__in=drifted).update(**actual)
+            fixed += len(drifted)
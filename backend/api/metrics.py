@@ -0,0 +1,161 @@
+import ipaddress
+from bisect import bisect_left
+from threading import Lock
+
+from django.http import Http404, HttpResponse
+
+from .caches import ingredient_cache, tag_cache, token_cache
+
+# Метрики хранятся в памяти процесса: при нескольких воркерах gunicorn
+# каждый отдаёт свои значения.
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200)
+
+CACHES = {
+    'tags': tag_cache,
+    'ingredients': ingredient_cache,
+    'tokens': token_cache,
+}
+
+
+class Histogram:
+    """ Гистограмма Prometheus: накопительные корзины, сумма и число
+    наблюдений для каждого набора меток.
+    """
+
+    def __init__(self, name, documentation, buckets):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = buckets
+        self.values = {}
+
+    def observe(self, labels, value):
+        counts = self.values.get(labels)
+        if counts is None:
+            counts = self.values[labels] = [0] * (len(self.buckets) + 2)
+        counts[bisect_left(self.buckets, value)] += 1
+        counts[-1] += value
+
+    def render(self, names):
+        yield f'# HELP {self.name} {self.documentation}'
+        yield f'# TYPE {self.name} histogram'
+        for labels, counts in sorted(self.values.items()):
+            text = format_labels(names, labels)
+            total = 0
+            for bound, count in zip(self.buckets, counts):
+                total += count
+                yield f'{self.name}_bucket{{{text},le="{bound}"}} {total}'
+            total += counts[-2]
+            yield f'{self.name}_bucket{{{text},le="+Inf"}} {total}'
+            yield f'{self.name}_sum{{{text}}} {counts[-1]}'
+            yield f'{self.name}_count{{{text}}} {total}'
+
+
+class Counter:
+    def __init__(self, name, documentation):
+        self.name = name
+        self.documentation = documentation
+        self.values = {}
+
+    def inc(self, labels, value=1):
+        self.values[labels] = self.values.get(labels, 0) + value
+
+    def render(self, names):
+        yield f'# HELP {self.name} {self.documentation}'
+        yield f'# TYPE {self.name} counter'
+        for labels, value in sorted(self.values.items()):
+            yield f'{self.name}{{{format_labels(names, labels)}}} {value}'
+
+
+def format_labels(names, values):
+    return ','.join(
+        '{}="{}"'.format(name, str(value).replace('\\', '\\\\').replace(
+            '"', '\\"'
+        ))
+        for name, value in zip(names, values)
+    )
+
+
+class RequestMetrics:
+    """ Метрики запросов по представлениям: время ответа, число
+    SQL-запросов, время в базе данных и повторяющиеся запросы.
+    """
+
+    labels = ('view', 'method')
+
+    def __init__(self):
+        self._lock = Lock()
+        self.latency = Histogram(
+            'foodgram_http_request_duration_seconds',
+            'Время обработки запроса.', LATENCY_BUCKETS,
+        )
+        self.queries = Histogram(
+            'foodgram_db_queries_per_request',
+            'Число SQL-запросов на запрос.', QUERY_BUCKETS,
+        )
+        self.db_time = Counter(
+            'foodgram_db_duration_seconds_total',
+            'Время выполнения SQL-запросов.',
+        )
+        self.duplicates = Counter(
+            'foodgram_db_duplicate_queries_total',
+            'SQL-запросы, повторившие текст уже выполненного '
+            'в том же запросе (признак N+1).',
+        )
+        self.responses = Counter(
+            'foodgram_http_responses_total', 'Ответы по кодам.',
+        )
+
+    def record(self, view, method, status, latency, queries, db_time,
+               duplicates):
+        labels = (view, method)
+        with self._lock:
+            self.latency.observe(labels, latency)
+            self.queries.observe(labels, queries)
+            self.db_time.inc(labels, db_time)
+            if duplicates:
+                self.duplicates.inc(labels, duplicates)
+            self.responses.inc((view, method, status))
+
+    def render(self):
+        with self._lock:
+            lines = [
+                *self.latency.render(self.labels),
+                *self.queries.render(self.labels),
+                *self.db_time.render(self.labels),
+                *self.duplicates.render(self.labels),
+                *self.responses.render(self.labels + ('status',)),
+            ]
+        hits = Counter('foodgram_cache_hits_total',
+                       'Попадания в кэши справочников и токенов.')
+        misses = Counter('foodgram_cache_misses_total',
+                         'Промахи кэшей справочников и токенов.')
+        for name, cache in CACHES.items():
+            stats = cache.stats()
+            hits.inc((name,), stats['hits'])
+            misses.inc((name,), stats['misses'])
+        lines.extend(hits.render(('cache',)))
+        lines.extend(misses.render(('cache',)))
+        return '\n'.join(lines) + '\n'
+
+
+request_metrics = RequestMetrics()
+
+
+def metrics(request):
+    """ Метрики в текстовом формате Prometheus.
+
+    Отдаются только на адреса из внутренних сетей: снаружи nginx
+    проксирует лишь /api/ и /admin/.
+    """
+    try:
+        address = ipaddress.ip_address(request.META.get('REMOTE_ADDR', ''))
+    except ValueError:
+        raise Http404
+    if not (address.is_private or address.is_loopback):
+        raise Http404
+    return HttpResponse(
+        request_metrics.render(),
+        content_type='text/plain; version=0.0.4; charset=utf-8',
+    )
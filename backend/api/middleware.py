@@ -0,0 +1,245 @@
+import cProfile
+import logging
+import os
+import random
+import time
+import uuid
+from contextlib import ExitStack, contextmanager
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from rest_framework.exceptions import APIException
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+
+from .metrics import request_metrics
+
+logger = logging.getLogger(__name__)
+
+# Сколько пар (представление, запрос) с повторами сообщать в журнал.
+DUPLICATE_REPORT_LIMIT = 1000
+
+# Методы, которые попадают в метки метрик как есть; остальные - `other`,
+# чтобы произвольный метод клиента не порождал новые ряды.
+METRIC_METHODS = frozenset((
+    'GET', 'POST', 'PUT', 'PATCH', 'DELETE', 'HEAD', 'OPTIONS',
+))
+
+# Команды управления транзакциями повторяются законно.
+TRANSACTION_STATEMENTS = ('BEGIN', 'SAVEPOINT', 'RELEASE', 'ROLLBACK',
+                          'COMMIT')
+
+
+@contextmanager
+def wrap_connections(wrapper):
+    """ Пропускает SQL-запросы всех подключений через `wrapper`."""
+    with ExitStack() as stack:
+        for alias in connections:
+            stack.enter_context(connections[alias].execute_wrapper(wrapper))
+        yield
+
+
+class QueryRecorder:
+    """ Считает SQL-запросы и время их выполнения; запросы с одинаковым
+    текстом (с разными параметрами) к одной базе учитываются как повторы.
+    """
+
+    __slots__ = ('count', 'duration', 'duplicates', 'statements')
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.duplicates = 0
+        self.statements = {}
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.duration += time.perf_counter() - start
+            self.count += 1
+            if not sql.startswith(TRANSACTION_STATEMENTS):
+                key = (context['connection'].alias, sql)
+                seen = self.statements.get(key, 0)
+                self.duplicates += seen > 0
+                self.statements[key] = seen + 1
+
+
+class MetricsMiddleware:
+    """ Собирает метрики запроса по представлению (см. api.metrics):
+    время ответа, число SQL-запросов и время в базе данных во всех
+    подключениях, повторяющиеся запросы. Первое появление повтора
+    для представления пишется в журнал вместе с текстом запроса.
+
+    С настройкой QUERY_COUNT_HEADER в ответ добавляется заголовок
+    X-DB-Queries для команды loadtest.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.reported = set()
+
+    def __call__(self, request):
+        recorder = QueryRecorder()
+        start = time.perf_counter()
+        with wrap_connections(recorder):
+            response = self.get_response(request)
+        latency = time.perf_counter() - start
+        match = request.resolver_match
+        view = match.view_name if match else 'unresolved'
+        method = request.method
+        if method not in METRIC_METHODS:
+            method = 'other'
+        request_metrics.record(
+            view, method, response.status_code, latency,
+            recorder.count, recorder.duration, recorder.duplicates,
+        )
+        if recorder.duplicates:
+            self.report_duplicates(view, recorder.statements)
+        if settings.QUERY_COUNT_HEADER:
+            response['X-DB-Queries'] = str(recorder.count)
+        return response
+
+    def report_duplicates(self, view, statements):
+        for (_, sql), count in statements.items():
+            key = (view, sql)
+            if (count < 2 or key in self.reported
+                    or len(self.reported) >= DUPLICATE_REPORT_LIMIT):
+                continue
+            self.reported.add(key)
+            logger.warning(
+                'Повторяющийся SQL-запрос в %s (%d раз): %s',
+                view, count, sql,
+            )
+
+
+class QueryLog:
+    """ Текст выполненных SQL-запросов и их время. Параметры запросов
+    не записываются: среди них бывают ключи токенов и другие секреты.
+    """
+
+    def __init__(self):
+        self.entries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = time.perf_counter() - start
+            self.entries.append((context['connection'].alias, duration, sql))
+
+
+class Profile:
+    """ Профиль одного запроса: cProfile и журнал SQL-запросов."""
+
+    def __init__(self, request):
+        self.request = request
+        self.profiler = cProfile.Profile()
+        self.queries = QueryLog()
+        self.elapsed = 0.0
+
+    def run(self, func, *args):
+        start = time.perf_counter()
+        with wrap_connections(self.queries):
+            self.profiler.enable()
+            try:
+                return func(*args)
+            finally:
+                self.profiler.disable()
+                self.elapsed += time.perf_counter() - start
+
+    def stream(self, content):
+        """ Профилирует формирование потокового ответа по частям
+        и сохраняет профиль, когда ответ отдан.
+        """
+        iterator = iter(content)
+        try:
+            while True:
+                try:
+                    chunk = self.run(next, iterator)
+                except StopIteration:
+                    return
+                yield chunk
+        finally:
+            self.save()
+
+    def finish(self, response):
+        match = self.request.resolver_match
+        view = match.view_name.replace(':', '.') if match else 'unresolved'
+        self.name = (
+            f'{time.strftime("%Y%m%d-%H%M%S")}-{view}-{uuid.uuid4().hex[:8]}'
+        )
+        self.status = response.status_code
+        response['X-Profile'] = self.name
+        if response.streaming:
+            response.streaming_content = self.stream(
+                response.streaming_content
+            )
+        else:
+            self.save()
+
+    def save(self):
+        path = os.path.join(settings.PROFILER_DIR, self.name)
+        self.profiler.dump_stats(f'{path}.prof')
+        db_time = sum(duration for _, duration, _ in self.queries.entries)
+        with open(f'{path}.sql', 'w', encoding='utf-8') as file:
+            file.write(
+                f'-- {self.request.method} {self.request.get_full_path()} '
+                f'{self.status}: {self.elapsed * 1000:.1f} мс, '
+                f'SQL-запросов: {len(self.queries.entries)}, '
+                f'{db_time * 1000:.1f} мс\n'
+            )
+            for alias, duration, sql in self.queries.entries:
+                file.write(f'\n-- {alias}, {duration * 1000:.2f} мс\n{sql};\n')
+
+
+class ProfilerMiddleware:
+    """ Профилирует запросы: выбранные случайно с вероятностью
+    settings.PROFILER_SAMPLE_RATE и запросы сотрудников с заголовком
+    X-Profile. В каталог settings.PROFILER_DIR сохраняются профиль
+    cProfile (`.prof`, для snakeviz или flameprof) и выполненные
+    SQL-запросы (`.sql`), имя файлов возвращается в заголовке X-Profile.
+
+    Без PROFILER_DIR промежуточный слой не подключается и ничего
+    не стоит. Каталог не должен быть доступен на чтение другим
+    пользователям системы: в профилях остаются пути и тексты запросов.
+    """
+
+    def __init__(self, get_response):
+        if not settings.PROFILER_DIR:
+            raise MiddlewareNotUsed
+        os.makedirs(settings.PROFILER_DIR, mode=0o700, exist_ok=True)
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not self.should_profile(request):
+            return self.get_response(request)
+        profile = Profile(request)
+        response = profile.run(self.get_response, request)
+        profile.finish(response)
+        return response
+
+    def should_profile(self, request):
+        if 'HTTP_X_PROFILE' in request.META:
+            return self.is_staff(request)
+        return (settings.PROFILER_SAMPLE_RATE > 0
+                and random.random() < settings.PROFILER_SAMPLE_RATE)
+
+    def is_staff(self, request):
+        """ Сотрудник ли автор запроса: по сессии или по заголовку
+        Authorization, как его проверяет API.
+        """
+        if request.user.is_staff:
+            return True
+        api_request = Request(request)
+        for authentication in api_settings.DEFAULT_AUTHENTICATION_CLASSES:
+            try:
+                result = authentication().authenticate(api_request)
+            except APIException:
+                return False
+            if result is not None:
+                return result[0].is_staff
+        return False
@@ -0,0 +1,21 @@
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0004_ingredient_name_unit_unique'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='amountingredient',
+            name='recipe',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='ingredient_amounts', to='api.recipe', verbose_name='Рецепт'),
+        ),
+        migrations.AddIndex(
+            model_name='amountingredient',
+            index=models.Index(fields=['recipe', 'ingredient'], name='amount_recipe_ingredient_idx'),
+        ),
+    ]
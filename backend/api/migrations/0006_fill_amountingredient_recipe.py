@@ -0,0 +1,64 @@
+from django.db import migrations, transaction
+
+BATCH_SIZE = 10000
+
+
+def fill_recipe(apps, schema_editor):
+    """ Переносит связи рецептов с общими записями AmountIngredient
+    в поле recipe пачками по BATCH_SIZE связей.
+
+    Первая связь общей записи назначает ей рецепт, для остальных
+    создаются копии. Каждая пачка выполняется в отдельной транзакции,
+    уже перенесённые связи пропускаются, поэтому прерванную миграцию
+    можно запустить повторно.
+    """
+    Recipe = apps.get_model('api', 'Recipe')
+    AmountIngredient = apps.get_model('api', 'AmountIngredient')
+    Link = Recipe.ingredients.through
+    last_id = 0
+    while True:
+        links = list(
+            Link.objects.filter(id__gt=last_id).order_by('id').values_list(
+                'id', 'recipe_id', 'amountingredient_id'
+            )[:BATCH_SIZE]
+        )
+        if not links:
+            return
+        last_id = links[-1][0]
+        with transaction.atomic():
+            amounts = AmountIngredient.objects.in_bulk(
+                {amount_id for _, _, amount_id in links}
+            )
+            done = set(AmountIngredient.objects.filter(
+                recipe_id__in={recipe_id for _, recipe_id, _ in links}
+            ).values_list('recipe_id', 'ingredient_id', 'amount'))
+            to_update, to_create = [], []
+            for _, recipe_id, amount_id in links:
+                amount = amounts[amount_id]
+                key = (recipe_id, amount.ingredient_id, amount.amount)
+                if key in done:
+                    continue
+                done.add(key)
+                if amount.recipe_id is None:
+                    amount.recipe_id = recipe_id
+                    to_update.append(amount)
+                else:
+                    to_create.append(AmountIngredient(
+                        recipe_id=recipe_id,
+                        ingredient_id=amount.ingredient_id,
+                        amount=amount.amount,
+                    ))
+            AmountIngredient.objects.bulk_update(to_update, ['recipe'])
+            AmountIngredient.objects.bulk_create(to_create)
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ('api', '0005_amountingredient_recipe'),
+    ]
+
+    operations = [
+        migrations.RunPython(fill_recipe, migrations.RunPython.noop),
+    ]
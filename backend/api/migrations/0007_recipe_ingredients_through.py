@@ -0,0 +1,20 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0006_fill_amountingredient_recipe'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='recipe',
+            name='ingredients',
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='ingredients',
+            field=models.ManyToManyField(help_text='Выберите ингредиенты для рецепта', related_name='recipes', through='api.AmountIngredient', to='api.Ingredient', verbose_name='Ингредиенты'),
+        ),
+    ]
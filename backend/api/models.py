@@ -1,6 +1,17 @@
+from threading import local
+
+from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.core.validators import MinValueValidator, RegexValidator
-from django.db import models
+from django.db import connections, models, transaction
+from django.db.models import (BooleanField, F, FloatField, OuterRef,
+                              Prefetch, Q, Subquery, Value)
+from django.db.models.expressions import RawSQL
+from django.utils import timezone
+
+from foodgram.counters import CounterFieldsMixin
+
+from .search import FTS_TABLE, SEARCH_CONFIG, fts_query
 
 User = get_user_model()
 
@@ -64,12 +75,71 @@ class Ingredient(models.Model):
         ordering = ('name',)
         verbose_name = 'Ингредиент'
         verbose_name_plural = 'Ингредиенты'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['name', 'measurement_unit'],
+                name='ingredient_name_unit_unique'
+            )
+        ]
 
     def __str__(self):
         return f'{self.name}, {self.measurement_unit}'
 
 
-class Recipe(models.Model):
+class RecipeQuerySet(models.QuerySet):
+    """ Набор запросов рецептов со связанными данными для чтения."""
+
+    def with_related(self):
+        """ Подгружает автора, тэги и ингредиенты фиксированным числом
+        запросов, независимо от количества рецептов.
+
+        У тэгов и количеств ингредиентов выбираются только ключи:
+        сами тэги и ингредиенты сериализаторы берут из api.caches,
+        оттуда же - признаки избранного, покупок и подписок.
+        """
+        return self.select_related('author').prefetch_related(
+            Prefetch('tags', queryset=Tag.objects.only('id')),
+            Prefetch(
+                'ingredient_amounts',
+                queryset=AmountIngredient.objects.order_by('id')
+            ),
+        )
+
+    def search(self, query):
+        """ Полнотекстовый поиск по названию и описанию, от более
+        подходящих рецептов к менее подходящим (аннотация `search_rank`).
+
+        В PostgreSQL используется столбец search_vector с GIN-индексом,
+        в SQLite - таблица FTS5 (модель RecipeSearchIndex), в остальных
+        базах - поиск подстроки без ранжирования.
+        """
+        vendor = connections[self.db].vendor
+        if vendor == 'postgresql':
+            tsquery = f"websearch_to_tsquery('{SEARCH_CONFIG}', %s)"
+            queryset = self.filter(RawSQL(
+                f'api_recipe.search_vector @@ {tsquery}', (query,),
+                output_field=BooleanField()
+            )).annotate(search_rank=RawSQL(
+                f'ts_rank(api_recipe.search_vector, {tsquery})', (query,),
+                output_field=FloatField()
+            ))
+        elif vendor == 'sqlite':
+            query = fts_query(query)
+            if not query:
+                return self.none()
+            # Для FTS5 сравнение скрытого столбца с именем таблицы
+            # равносильно MATCH; rank - bm25 со знаком минус.
+            queryset = self.filter(search_index__match=query).annotate(
+                search_rank=-F('search_index__rank')
+            )
+        else:
+            queryset = self.filter(
+                Q(name__icontains=query) | Q(text__icontains=query)
+            ).annotate(search_rank=Value(0.0, output_field=FloatField()))
+        return queryset.order_by('-search_rank', '-pub_date', '-id')
+
+
+class Recipe(CounterFieldsMixin, models.Model):
     """ Основная модель приложения, описывающая рецепты.
 
     Поля:
@@ -77,11 +147,18 @@ class Recipe(models.Model):
         author(int) - Автор рецепта.
         tags(int) - Тэги рецепта. Связь M2M с моделью Tag.
         ingredients(int) - Ингредиенты для приготовления.
-                           Связь M2M с моделью AmountIngredient.
+                           Связь M2M с моделью Ingredient
+                           через модель AmountIngredient.
         pub_date(datetime) - Дата добавления рецепта.
+        updated_at(datetime) - Дата последнего изменения рецепта.
         image(str) - Изображение рецепта.
+        image_variants(dict) - Уменьшенные копии изображения
+                               вида {'320w': путь к файлу}.
         text(str) - Описание рецепта.ё
         cooking_time(int) - Время приготовления рецепта.
+        favorites_count(int) - Сколько пользователей добавили рецепт
+                               в избранное.
+        in_carts_count(int) - В скольких списках покупок есть рецепт.
     """
 
     author = models.ForeignKey(
@@ -99,12 +176,18 @@ class Recipe(models.Model):
         verbose_name='Картинка',
         upload_to='recipes/',
     )
+    image_variants = models.JSONField(
+        verbose_name='Уменьшенные копии картинки',
+        default=dict,
+        blank=True,
+    )
     text = models.TextField(
         verbose_name='Описание рецепта',
         help_text='Введите описание рецепта',
     )
     ingredients = models.ManyToManyField(
-        'AmountIngredient',
+        Ingredient,
+        through='AmountIngredient',
         related_name='recipes',
         verbose_name='Ингредиенты',
         help_text='Выберите ингредиенты для рецепта',
@@ -131,19 +214,94 @@ class Recipe(models.Model):
         auto_now_add=True,
         verbose_name='Дата публикации',
     )
+    updated_at = models.DateTimeField(
+        auto_now=True,
+        verbose_name='Дата изменения',
+    )
+    favorites_count = models.PositiveIntegerField(
+        verbose_name='В избранном',
+        default=0,
+        editable=False,
+    )
+    in_carts_count = models.PositiveIntegerField(
+        verbose_name='В списках покупок',
+        default=0,
+        editable=False,
+    )
+
+    counter_fields = ('favorites_count', 'in_carts_count')
+
+    objects = RecipeQuerySet.as_manager()
 
     class Meta:
-        ordering = ('-pub_date',)
+        ordering = ('-pub_date', '-id')
         verbose_name = 'Рецепт'
         verbose_name_plural = 'Рецепты'
+        indexes = [
+            models.Index(
+                fields=['-pub_date', '-id'],
+                name='recipe_pub_date_id_idx'
+            ),
+            models.Index(
+                fields=['author', '-pub_date', '-id'],
+                name='recipe_author_pub_date_idx'
+            ),
+        ]
 
     def __str__(self):
         return self.name
 
 
+class RecipeSearchIndex(models.Model):
+    """ Таблица FTS5 для поиска рецептов в SQLite.
+
+    Создаётся миграцией и обновляется триггерами (api.search),
+    модель нужна только для соединения с рецептами в запросах.
+
+    Поля:
+        recipe(int) - Рецепт, rowid записи индекса.
+        match(str) - Скрытый столбец FTS5 с именем таблицы: условие
+                     `match=запрос` ищет по всем столбцам.
+        rank(float) - Релевантность (bm25 со знаком минус).
+    """
+
+    recipe = models.OneToOneField(
+        Recipe,
+        primary_key=True,
+        db_column='rowid',
+        db_constraint=False,
+        on_delete=models.DO_NOTHING,
+        related_name='search_index',
+    )
+    name = models.TextField()
+    text = models.TextField()
+    match = models.TextField(db_column=FTS_TABLE)
+    rank = models.FloatField()
+
+    class Meta:
+        managed = False
+        db_table = FTS_TABLE
+
+
 class AmountIngredient(models.Model):
-    """ Количество ингредиентов в блюде."""
+    """ Количество ингредиента в рецепте.
 
+    Поля:
+        recipe(int) - Рецепт. Пустое значение только у записей,
+                      оставшихся от общих количеств до перехода на
+                      отдельные записи для каждого рецепта; такие записи
+                      удаляет команда compact_ingredient_amounts.
+        ingredient(int) - Ингредиент.
+        amount(int) - Количество ингредиента.
+    """
+
+    recipe = models.ForeignKey(
+        Recipe,
+        on_delete=models.CASCADE,
+        verbose_name='Рецепт',
+        related_name='ingredient_amounts',
+        null=True,
+    )
     ingredient = models.ForeignKey(
         Ingredient,
         on_delete=models.CASCADE,
@@ -163,6 +321,12 @@ class AmountIngredient(models.Model):
     class Meta:
         verbose_name = 'Количество ингредиента'
         verbose_name_plural = 'Количество ингредиентов'
+        indexes = [
+            models.Index(
+                fields=['recipe', 'ingredient'],
+                name='amount_recipe_ingredient_idx'
+            )
+        ]
 
     def __str__(self):
         return f'{self.amount} {self.ingredient}'
@@ -199,6 +363,26 @@ class Favorite(models.Model):
         return f'Рецепт {self.recipe} в избранном у {self.user}'
 
 
+class FollowQuerySet(models.QuerySet):
+    """ Набор запросов подписок с данными об авторах."""
+
+    def with_recipes(self, limit=None):
+        """ Подгружает авторов и не более `limit` последних рецептов
+        каждого автора в атрибуте `author.recipe_previews`.
+        Число запросов не зависит от количества подписок.
+        """
+        recipes = Recipe.objects.all()
+        if limit is not None:
+            recipes = recipes.filter(id__in=Subquery(
+                Recipe.objects.filter(
+                    author=OuterRef('author')
+                ).values('id')[:limit]
+            ))
+        return self.select_related('author').prefetch_related(Prefetch(
+            'author__recipes', queryset=recipes, to_attr='recipe_previews'
+        ))
+
+
 class Follow(models.Model):
     user = models.ForeignKey(
         User,
@@ -215,6 +399,8 @@ class Follow(models.Model):
         verbose_name='Дата подписки',
     )
 
+    objects = FollowQuerySet.as_manager()
+
     class Meta:
         verbose_name = 'Подписка'
         verbose_name_plural = 'Подписки'
@@ -256,3 +442,220 @@ class Purchase(models.Model):
 
     def __str__(self):
         return f'Рецепт {self.recipe} в списке покупок {self.user}'
+
+
+class TimelineEntryQuerySet(models.QuerySet):
+    """ Набор запросов ленты подписок."""
+
+    @staticmethod
+    def is_popular(author):
+        """ Больше ли у автора подписчиков, чем settings.FEED_FANOUT_LIMIT.
+        Счётчик читается из базы: у объекта автора он может быть устаревшим
+        после атомарного изменения в сигнале.
+        """
+        followers_count = User.objects.filter(pk=author.pk).values_list(
+            'followers_count', flat=True
+        ).first()
+        return (followers_count or 0) > settings.FEED_FANOUT_LIMIT
+
+    def fan_out(self, recipe):
+        """ Добавляет рецепт в ленты подписчиков автора (fan-out on write).
+
+        Рецепты авторов, у которых подписчиков больше
+        settings.FEED_FANOUT_LIMIT, в ленты не копируются: они
+        выбираются при чтении ленты. Возвращает число записей.
+        """
+        author = recipe.author
+        if self.is_popular(author):
+            return 0
+        followers = Follow.objects.filter(author=author).values_list(
+            'user_id', flat=True
+        )
+        return len(self.bulk_create(
+            [
+                self.model(user_id=user_id, recipe=recipe, author=author,
+                           pub_date=recipe.pub_date)
+                for user_id in followers
+            ],
+            batch_size=settings.FEED_FANOUT_BATCH_SIZE,
+            ignore_conflicts=True,
+        ))
+
+    def backfill(self, user, author):
+        """ Добавляет в ленту нового подписчика последние
+        settings.FEED_BACKFILL_SIZE рецептов автора.
+        """
+        if self.is_popular(author):
+            return 0
+        recipes = Recipe.objects.filter(author=author).values_list(
+            'id', 'pub_date'
+        )[:settings.FEED_BACKFILL_SIZE]
+        return len(self.bulk_create(
+            [
+                self.model(user=user, recipe_id=recipe_id, author=author,
+                           pub_date=pub_date)
+                for recipe_id, pub_date in recipes
+            ],
+            ignore_conflicts=True,
+        ))
+
+    def sources(self, user):
+        """ Источники ленты пользователя для FeedCursorPagination:
+        его записи ленты и рецепты авторов с большим числом подписчиков,
+        на которых он подписан (fan-out on read).
+        """
+        popular = list(Follow.objects.filter(
+            user=user,
+            author__followers_count__gt=settings.FEED_FANOUT_LIMIT
+        ).values_list('author_id', flat=True))
+        sources = [(self.filter(user=user), 'pub_date', 'recipe_id')]
+        if popular:
+            sources.append((
+                Recipe.objects.filter(author_id__in=popular),
+                'pub_date', 'id'
+            ))
+        return sources
+
+
+class TimelineEntry(models.Model):
+    """ Запись ленты подписок: рецепт автора, на которого подписан
+    пользователь.
+
+    Поля:
+        user(int) - Владелец ленты.
+        recipe(int) - Рецепт.
+        author(int) - Автор рецепта, для удаления записей при отписке.
+        pub_date(datetime) - Дата публикации рецепта, копия
+                             Recipe.pub_date для сортировки по индексу.
+    """
+
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='timeline',
+    )
+    recipe = models.ForeignKey(
+        Recipe,
+        on_delete=models.CASCADE,
+        related_name='timeline_entries',
+    )
+    author = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='+',
+        db_index=False,
+    )
+    pub_date = models.DateTimeField(
+        verbose_name='Дата публикации',
+    )
+
+    objects = TimelineEntryQuerySet.as_manager()
+
+    class Meta:
+        verbose_name = 'Запись ленты'
+        verbose_name_plural = 'Записи ленты'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'recipe'], name='timeline_user_recipe_unique'
+            )
+        ]
+        indexes = [
+            models.Index(
+                fields=['user', '-pub_date', '-recipe'],
+                name='timeline_user_pub_date_idx'
+            ),
+            models.Index(
+                fields=['user', 'author'],
+                name='timeline_user_author_idx'
+            ),
+        ]
+
+    def __str__(self):
+        return f'Рецепт {self.recipe} в ленте {self.user}'
+
+
+# Ключи ContentVersion, ожидающие фиксации транзакции в текущем потоке.
+_pending_versions = local()
+
+
+class ContentVersionQuerySet(models.QuerySet):
+    """ Набор запросов счётчиков версий."""
+
+    def bump(self, *keys):
+        """ Увеличивает версии `keys` после фиксации текущей транзакции
+        (сразу, если транзакции нет).
+
+        Ключи копятся в пределах транзакции, и каждый увеличивается
+        один раз, сколько бы изменений ни было. Ключи откатившейся
+        транзакции увеличатся вместе со следующей - это безопасно.
+        """
+        _pending_versions.__dict__.setdefault('keys', set()).update(keys)
+        transaction.on_commit(self._bump_pending)
+
+    def _bump_pending(self):
+        keys = getattr(_pending_versions, 'keys', None)
+        if keys:
+            _pending_versions.keys = set()
+            self._bump(sorted(keys))
+
+    def _bump(self, keys):
+        now = timezone.now()
+        for key in keys:
+            versions = self.filter(key=key)
+            if versions.update(version=F('version') + 1, updated_at=now):
+                continue
+            _, created = self.get_or_create(
+                key=key, defaults={'version': 1, 'updated_at': now}
+            )
+            if not created:
+                versions.update(version=F('version') + 1, updated_at=now)
+
+    def get_versions(self, keys):
+        """ Возвращает словарь {ключ: (версия, время изменения)}.
+        Для ещё не изменявшихся ключей версия равна нулю.
+        """
+        versions = dict.fromkeys(keys, (0, None))
+        for key, version, updated_at in self.filter(
+            key__in=keys
+        ).values_list('key', 'version', 'updated_at'):
+            versions[key] = (version, updated_at)
+        return versions
+
+
+class ContentVersion(models.Model):
+    """ Счётчик версии группы данных для условных запросов.
+
+    Поля:
+        key(str) - Группа данных: `tags`, `ingredients`, `recipes`, `users`
+                   или `user:<id>` для избранного, покупок, подписок
+                   и токенов пользователя.
+        version(int) - Номер версии, растёт при каждом изменении.
+        updated_at(datetime) - Время последнего изменения.
+    """
+
+    key = models.CharField(
+        primary_key=True,
+        max_length=64,
+        verbose_name='Ключ',
+    )
+    version = models.PositiveBigIntegerField(
+        default=0,
+        verbose_name='Версия',
+    )
+    updated_at = models.DateTimeField(
+        default=timezone.now,
+        verbose_name='Дата изменения',
+    )
+
+    objects = ContentVersionQuerySet.as_manager()
+
+    class Meta:
+        verbose_name = 'Версия данных'
+        verbose_name_plural = 'Версии данных'
+
+    def __str__(self):
+        return f'{self.key}: {self.version}'
+
+    @staticmethod
+    def user_key(user_id):
+        return f'user:{user_id}'
@@ -1,4 +1,14 @@
-from rest_framework.pagination import PageNumberPagination
+import base64
+import binascii
+from collections import OrderedDict
+
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import remove_query_param, replace_query_param
 
 
 class CustomPagination(PageNumberPagination):
@@ -6,3 +16,129 @@ class CustomPagination(PageNumberPagination):
     `page_size_query_param`, для вывода запрошенного количества страниц.
     """
     page_size_query_param = 'limit'
+
+
+class RecipeCursorPagination(BasePagination):
+    """ Курсорная (keyset) пагинация рецептов по паре (pub_date, id).
+
+    Страница выбирается условием на ключ последнего показанного рецепта
+    по индексу recipe_pub_date_id_idx, поэтому время ответа не зависит
+    от глубины страницы, а общее количество рецептов не считается.
+    Ответ содержит ссылки `next` и `previous` и список `results`.
+    """
+
+    page_size = api_settings.PAGE_SIZE
+    page_size_query_param = 'limit'
+    max_page_size = 100
+    cursor_query_param = 'cursor'
+    invalid_cursor_message = 'Некорректный курсор.'
+
+    def get_page_size(self, request):
+        value = request.query_params.get(self.page_size_query_param, '')
+        if value.isdigit() and int(value) > 0:
+            return min(int(value), self.max_page_size)
+        return self.page_size
+
+    def encode_cursor(self, reverse, recipe):
+        position = (f'{"p" if reverse else "n"}|'
+                    f'{recipe.pub_date.isoformat()}|{recipe.id}')
+        cursor = base64.urlsafe_b64encode(position.encode()).decode()
+        return replace_query_param(
+            self.base_url, self.cursor_query_param, cursor
+        )
+
+    def decode_cursor(self, request):
+        """ Возвращает пару (назад ли, (pub_date, id) или None)."""
+        cursor = request.query_params.get(self.cursor_query_param)
+        if not cursor:
+            return False, None
+        try:
+            direction, pub_date, pk = base64.urlsafe_b64decode(
+                cursor.encode()
+            ).decode().split('|')
+            pub_date = parse_datetime(pub_date)
+            pk = int(pk)
+        except (binascii.Error, UnicodeDecodeError, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+        if pub_date is None or direction not in ('n', 'p'):
+            raise NotFound(self.invalid_cursor_message)
+        return direction == 'p', (pub_date, pk)
+
+    def filter_page(self, queryset, position, reverse, size,
+                    pub_date='pub_date', pk='id'):
+        """ Ограничивает `queryset` записями после курсора `position`
+        в порядке (`pub_date`, `pk`) и оставляет не больше `size` из них.
+        """
+        if position is not None:
+            value, key = position
+            lookup = 'gt' if reverse else 'lt'
+            # Избыточное условие `{lookup}e` даёт базе данных границу
+            # для поиска по индексу вместо просмотра с начала диапазона.
+            queryset = queryset.filter(
+                Q(**{f'{pub_date}__{lookup}': value})
+                | Q(**{pub_date: value, f'{pk}__{lookup}': key}),
+                **{f'{pub_date}__{lookup}e': value}
+            )
+        ordering = (pub_date, pk) if reverse else (f'-{pub_date}', f'-{pk}')
+        return queryset.order_by(*ordering)[:size]
+
+    def get_page(self, queryset, position, reverse, size):
+        return list(self.filter_page(queryset, position, reverse, size))
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.base_url = request.build_absolute_uri()
+        page_size = self.get_page_size(request)
+        reverse, position = self.decode_cursor(request)
+        page = self.get_page(queryset, position, reverse, page_size + 1)
+        has_more = len(page) > page_size
+        page = page[:page_size]
+        if reverse:
+            page.reverse()
+        self.has_next = has_more if not reverse else position is not None
+        self.has_previous = position is not None if not reverse else has_more
+        self.page = page
+        return page
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_cursor(False, self.page[-1])
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        if not self.page:
+            return remove_query_param(self.base_url, self.cursor_query_param)
+        return self.encode_cursor(True, self.page[0])
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+            ('results', data),
+        ]))
+
+
+class FeedCursorPagination(RecipeCursorPagination):
+    """ Курсорная пагинация ленты подписок.
+
+    Вместо одного набора запросов принимает список источников - троек
+    (queryset, поле даты публикации, поле id рецепта). Из каждого
+    источника по его индексу выбирается не больше страницы ключей,
+    ключи объединяются без повторов, а рецепты страницы загружаются
+    одним запросом из `recipes`.
+    """
+
+    def __init__(self, recipes):
+        self.recipes = recipes
+
+    def get_page(self, sources, position, reverse, size):
+        keys = set()
+        for queryset, pub_date, pk in sources:
+            keys.update(self.filter_page(
+                queryset.values_list(pub_date, pk),
+                position, reverse, size, pub_date, pk
+            ))
+        keys = sorted(keys, reverse=not reverse)[:size]
+        recipes = self.recipes.in_bulk([pk for _, pk in keys])
+        return [recipes[pk] for _, pk in keys if pk in recipes]
@@ -0,0 +1,175 @@
+import csv
+import io
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import close_old_connections
+from reportlab.lib.pagesizes import A4
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfbase.ttfonts import TTFError, TTFont
+from reportlab.pdfgen import canvas
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+
+PDF_EXECUTOR = ThreadPoolExecutor(
+    max_workers=settings.SHOPPING_CART_PDF_WORKERS,
+    thread_name_prefix='shopping-cart-pdf',
+)
+
+
+class ShoppingCartRenderer(BaseRenderer):
+    """ Базовый класс форматов выгрузки списка покупок.
+
+    Обычные ответы (например, ошибки) отдаются в JSON, а сам список
+    формируется по частям методом `stream` для `StreamingHttpResponse`.
+    """
+
+    charset = 'utf-8'
+    filename = 'shopping_ingredients'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        """ Обычный ответ целиком отдаёт JSONRenderer, вместе с его типом
+        содержимого: заголовок, выбранный по формату выгрузки, заменяется.
+        """
+        renderer = JSONRenderer()
+        response = (renderer_context or {}).get('response')
+        if response is not None:
+            response['Content-Type'] = renderer.media_type
+        return renderer.render(data, renderer.media_type, renderer_context)
+
+    def get_content_type(self):
+        if self.charset is None:
+            return self.media_type
+        return f'{self.media_type}; charset={self.charset}'
+
+    def get_filename(self):
+        return f'{self.filename}.{self.format}'
+
+    def stream(self, ingredients):
+        """ Возвращает итератор по частям файла.
+
+        ingredients - словари с ключами `ingredient__name`,
+        `ingredient__measurement_unit` и `total`.
+        """
+        raise NotImplementedError
+
+
+class TextShoppingCartRenderer(ShoppingCartRenderer):
+    media_type = 'text/plain'
+    format = 'txt'
+
+    def stream(self, ingredients):
+        for index, item in enumerate(ingredients):
+            line = (f'{item["ingredient__name"]}, {item["total"]}'
+                    f' {item["ingredient__measurement_unit"]}')
+            yield line if index == 0 else f'\n{line}'
+
+
+class _Echo:
+    """ Буфер для `csv.writer`, возвращающий записанную строку."""
+
+    def write(self, value):
+        return value
+
+
+class CSVShoppingCartRenderer(ShoppingCartRenderer):
+    media_type = 'text/csv'
+    format = 'csv'
+
+    def stream(self, ingredients):
+        writer = csv.writer(_Echo())
+        yield writer.writerow(
+            ('Ингредиент', 'Количество', 'Единица измерения')
+        )
+        for item in ingredients:
+            yield writer.writerow((
+                item['ingredient__name'],
+                item['total'],
+                item['ingredient__measurement_unit'],
+            ))
+
+
+class JSONShoppingCartRenderer(ShoppingCartRenderer):
+    media_type = 'application/json'
+    format = 'json'
+
+    def stream(self, ingredients):
+        yield '['
+        for index, item in enumerate(ingredients):
+            if index:
+                yield ','
+            yield json.dumps({
+                'name': item['ingredient__name'],
+                'amount': item['total'],
+                'measurement_unit': item['ingredient__measurement_unit'],
+            }, ensure_ascii=False)
+        yield ']'
+
+
+class PDFShoppingCartRenderer(ShoppingCartRenderer):
+    """ Формат PDF.
+
+    Документ собирается в пуле `PDF_EXECUTOR`, чтобы тяжёлая отрисовка
+    не выполнялась в потоке запроса и была ограничена числом потоков,
+    и отдаётся частями по `chunk_size` байт. Список ингредиентов поток
+    пула читает из базы сам, своим подключением.
+    """
+
+    media_type = 'application/pdf'
+    format = 'pdf'
+    charset = None
+    font_name = 'ShoppingCartFont'
+    chunk_size = 64 * 1024
+
+    def stream(self, ingredients):
+        future = PDF_EXECUTOR.submit(self.build_in_pool, ingredients)
+        return self._iter_chunks(future)
+
+    def _iter_chunks(self, future):
+        content = future.result()
+        for start in range(0, len(content), self.chunk_size):
+            yield content[start:start + self.chunk_size]
+
+    def _get_font(self):
+        if self.font_name not in pdfmetrics.getRegisteredFontNames():
+            try:
+                pdfmetrics.registerFont(TTFont(
+                    self.font_name, settings.SHOPPING_CART_PDF_FONT
+                ))
+            except TTFError:
+                return 'Helvetica'
+        return self.font_name
+
+    def build_in_pool(self, ingredients):
+        """ Задача пула: подключения потока пула закрываются до и после
+        сборки, как у обработчика запроса.
+        """
+        close_old_connections()
+        try:
+            return self.build(ingredients)
+        finally:
+            close_old_connections()
+
+    def build(self, ingredients):
+        buffer = io.BytesIO()
+        page = canvas.Canvas(buffer, pagesize=A4)
+        font = self._get_font()
+        height = A4[1]
+        top, bottom, left, step = height - 60, 50, 50, 20
+        page.setFont(font, 16)
+        page.drawString(left, top, 'Список покупок')
+        y = top - 2 * step
+        page.setFont(font, 12)
+        for item in ingredients:
+            if y < bottom:
+                page.showPage()
+                page.setFont(font, 12)
+                y = top
+            page.drawString(
+                left, y,
+                f'• {item["ingredient__name"]} '
+                f'({item["ingredient__measurement_unit"]}) — {item["total"]}'
+            )
+            y -= step
+        page.save()
+        return buffer.getvalue()
@@ -0,0 +1,113 @@
+import re
+
+# Полнотекстовый поиск рецептов по названию и описанию.
+#
+# PostgreSQL: вычисляемый столбец api_recipe.search_vector (tsvector
+# с русской морфологией, название весомее описания) и GIN-индекс по нему.
+# SQLite: внешняя таблица FTS5 api_recipe_fts, которую триггеры
+# обновляют при добавлении, изменении и удалении рецептов.
+
+SEARCH_CONFIG = 'russian'
+SEARCH_INDEX_NAME = 'api_recipe_search_gin'
+FTS_TABLE = 'api_recipe_fts'
+
+POSTGRESQL_CREATE = (
+    'ALTER TABLE api_recipe ADD COLUMN IF NOT EXISTS search_vector tsvector '
+    'GENERATED ALWAYS AS ('
+    f"setweight(to_tsvector('{SEARCH_CONFIG}', coalesce(name, '')), 'A') || "
+    f"setweight(to_tsvector('{SEARCH_CONFIG}', coalesce(text, '')), 'B')"
+    ') STORED',
+    f'CREATE INDEX IF NOT EXISTS {SEARCH_INDEX_NAME} '
+    'ON api_recipe USING gin (search_vector)',
+)
+POSTGRESQL_DROP = (
+    f'DROP INDEX IF EXISTS {SEARCH_INDEX_NAME}',
+    'ALTER TABLE api_recipe DROP COLUMN IF EXISTS search_vector',
+)
+
+SQLITE_TABLE = (
+    f'CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5('
+    "name, text, content='api_recipe', content_rowid='id', "
+    "tokenize='unicode61 remove_diacritics 2')"
+)
+SQLITE_TRIGGERS = {
+    f'{FTS_TABLE}_insert': (
+        'AFTER INSERT ON api_recipe BEGIN '
+        f'INSERT INTO {FTS_TABLE}(rowid, name, text) '
+        'VALUES (new.id, new.name, new.text); END'
+    ),
+    f'{FTS_TABLE}_delete': (
+        'AFTER DELETE ON api_recipe BEGIN '
+        f'INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, name, text) '
+        "VALUES ('delete', old.id, old.name, old.text); END"
+    ),
+    f'{FTS_TABLE}_update': (
+        'AFTER UPDATE OF name, text ON api_recipe BEGIN '
+        f'INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, name, text) '
+        "VALUES ('delete', old.id, old.name, old.text); "
+        f'INSERT INTO {FTS_TABLE}(rowid, name, text) '
+        'VALUES (new.id, new.name, new.text); END'
+    ),
+}
+
+# Релевантность в SQLite: bm25 с весами названия и описания.
+SQLITE_RANK = (
+    f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rank) "
+    "VALUES ('rank', 'bm25(10.0, 1.0)')"
+)
+
+
+def create_search_index(connection):
+    """ Создаёт поисковый индекс рецептов, если его ещё нет.
+
+    В SQLite при пересоздании таблицы api_recipe (так Django выполняет
+    часть миграций) триггеры удаляются вместе с ней, поэтому функция
+    вызывается и после каждого migrate: недостающие триггеры
+    создаются заново, а индекс перестраивается.
+    """
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            for sql in POSTGRESQL_CREATE:
+                cursor.execute(sql)
+        elif connection.vendor == 'sqlite':
+            cursor.execute(SQLITE_TABLE)
+            cursor.execute(SQLITE_RANK)
+            cursor.execute(
+                "SELECT name FROM sqlite_master WHERE type = 'trigger' "
+                'AND tbl_name = %s', ['api_recipe']
+            )
+            existing = {name for name, in cursor.fetchall()}
+            missing = set(SQLITE_TRIGGERS) - existing
+            for name in sorted(missing):
+                cursor.execute(
+                    f'CREATE TRIGGER {name} {SQLITE_TRIGGERS[name]}'
+                )
+            if missing:
+                cursor.execute(
+                    f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')"
+                )
+
+
+def drop_search_index(connection):
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            for sql in POSTGRESQL_DROP:
+                cursor.execute(sql)
+        elif connection.vendor == 'sqlite':
+            for name in SQLITE_TRIGGERS:
+                cursor.execute(f'DROP TRIGGER IF EXISTS {name}')
+            cursor.execute(f'DROP TABLE IF EXISTS {FTS_TABLE}')
+
+
+def fts_query(query):
+    """ Запрос FTS5 из слов строки поиска: все слова обязательны
+    и ищутся по началу.
+
+    У FTS5 нет русской морфологии, поэтому от слов длиннее четырёх букв
+    отбрасываются два последних символа - грубая замена стемминга:
+    «котлеты» находит «котлета», «борща» - «борщ».
+    """
+    words = re.findall(r'\w+', query.lower())
+    return ' '.join(
+        f'"{word[:max(4, len(word) - 2)]}"*' for word in words
+    )
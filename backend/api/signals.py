@@ -0,0 +1,161 @@
+from django.core.signals import request_started
+from django.db import connections
+from django.db.models import F
+from django.db.models.signals import (m2m_changed, post_delete, post_migrate,
+                                      post_save)
+from django.dispatch import receiver
+from rest_framework.authtoken.models import Token
+
+from .caches import (ingredient_cache, reset_versions, tag_cache,
+                     token_cache, update_memberships)
+from .indexes import (ingredient_index, ingredient_responses,
+                      ingredient_trigram_index)
+from .models import (AmountIngredient, ContentVersion, Favorite, Follow,
+                     Ingredient, Purchase, Recipe, Tag, TimelineEntry, User)
+from .search import create_search_index
+
+
+@receiver((post_save, post_delete), sender=Ingredient)
+def invalidate_ingredient_indexes(sender, **kwargs):
+    ingredient_index.invalidate()
+    ingredient_trigram_index.invalidate()
+    ingredient_responses.invalidate()
+    ingredient_cache.invalidate()
+
+
+@receiver((post_save, post_delete), sender=Tag)
+def invalidate_tag_cache(sender, **kwargs):
+    tag_cache.invalidate()
+
+
+@receiver(request_started)
+def reset_reference_versions(sender, **kwargs):
+    reset_versions()
+
+
+@receiver((post_save, post_delete), sender=Ingredient)
+def bump_ingredients_version(sender, **kwargs):
+    ContentVersion.objects.bump('ingredients')
+
+
+@receiver((post_save, post_delete), sender=Tag)
+def bump_tags_version(sender, **kwargs):
+    ContentVersion.objects.bump('tags')
+
+
+@receiver((post_save, post_delete), sender=Recipe)
+@receiver((post_save, post_delete), sender=AmountIngredient)
+@receiver(m2m_changed, sender=Recipe.tags.through)
+def bump_recipes_version(sender, action=None, **kwargs):
+    """ Количества ингредиентов можно изменить и без сохранения рецепта
+    (в админке). Версия `recipes` входит и в ETag списка покупок,
+    поэтому версии пользователей, у которых рецепт в покупках,
+    увеличивать не нужно.
+    """
+    if action is None or action.startswith('post_'):
+        ContentVersion.objects.bump('recipes')
+
+
+@receiver(post_save, sender=User)
+def bump_users_version(sender, instance, created, update_fields,
+                       **kwargs):
+    """ Данные автора выводятся в рецептах (версия `users`), а по версии
+    `user:<id>` проверяются записи кэша токенов этого пользователя.
+    Новые пользователи и обновление времени входа на выдачу не влияют.
+    """
+    if created or update_fields == frozenset({'last_login'}):
+        return
+    ContentVersion.objects.bump(
+        'users', ContentVersion.user_key(instance.id)
+    )
+
+
+@receiver((post_save, post_delete), sender=Favorite)
+@receiver((post_save, post_delete), sender=Purchase)
+@receiver((post_save, post_delete), sender=Follow)
+def bump_user_version(sender, instance, signal, created=False, **kwargs):
+    ContentVersion.objects.bump(ContentVersion.user_key(instance.user_id))
+    if created or signal is post_delete:
+        update_memberships(instance, added=created)
+
+
+@receiver(post_delete, sender=Token)
+def revoke_token(sender, instance, **kwargs):
+    """ Выход из системы и удаление токена сразу отзывают его
+    кэшированную проверку во всех процессах.
+    """
+    token_cache.delete(instance.key)
+    ContentVersion.objects.bump(ContentVersion.user_key(instance.user_id))
+
+
+def change_counter(queryset, field, delta):
+    """ Атомарно изменяет счётчик `field` у объектов `queryset` на `delta`.
+    Счётчик не уходит ниже нуля; расхождения исправляет команда
+    reconcile_counters.
+
+    Счётчики пользователей читаются и из кэша токенов, поэтому
+    вызывающий код увеличивает версию `user:<id>` автора.
+    """
+    if delta < 0:
+        queryset = queryset.filter(**{f'{field}__gt': 0})
+    queryset.update(**{field: F(field) + delta})
+
+
+@receiver((post_save, post_delete), sender=Favorite)
+@receiver((post_save, post_delete), sender=Purchase)
+def update_recipe_counters(sender, instance, signal, created=False,
+                           **kwargs):
+    if not created and signal is not post_delete:
+        return
+    field = 'favorites_count' if sender is Favorite else 'in_carts_count'
+    change_counter(
+        Recipe.objects.filter(pk=instance.recipe_id), field,
+        1 if created else -1
+    )
+
+
+@receiver((post_save, post_delete), sender=Recipe)
+def update_author_recipes_count(sender, instance, signal, created=False,
+                                **kwargs):
+    if not created and signal is not post_delete:
+        return
+    change_counter(
+        User.objects.filter(pk=instance.author_id), 'recipes_count',
+        1 if created else -1
+    )
+    ContentVersion.objects.bump(ContentVersion.user_key(instance.author_id))
+
+
+@receiver((post_save, post_delete), sender=Follow)
+def update_followers(sender, instance, signal, created=False, **kwargs):
+    """ Ведёт счётчик подписчиков автора и ленту подписчика: при подписке
+    в ленту добавляются последние рецепты автора, при отписке удаляются.
+    """
+    if not created and signal is not post_delete:
+        return
+    change_counter(
+        User.objects.filter(pk=instance.author_id), 'followers_count',
+        1 if created else -1
+    )
+    ContentVersion.objects.bump(ContentVersion.user_key(instance.author_id))
+    if created:
+        TimelineEntry.objects.backfill(instance.user, instance.author)
+    else:
+        TimelineEntry.objects.filter(
+            user_id=instance.user_id, author_id=instance.author_id
+        ).delete()
+
+
+@receiver(post_migrate)
+def restore_search_index(sender, app_config, using, plan=None, **kwargs):
+    """ Восстанавливает триггеры поиска SQLite, удалённые при
+    пересоздании таблицы рецептов в миграциях.
+    """
+    if app_config.label != 'api':
+        return
+    applied = plan is None or any(
+        migration.app_label == 'api' and not backwards
+        for migration, backwards in plan
+    )
+    if applied and connections[using].vendor == 'sqlite':
+        create_search_index(connections[using])
@@ -0,0 +1,36 @@
+import hashlib
+import os
+
+from django.core.files.storage import FileSystemStorage
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    """ Хранилище, именующее файлы по SHA-256 их содержимого.
+
+    Файл `recipes/photo.png` сохраняется как `recipes/ab/ab12...ef.png`,
+    поэтому одинаковые изображения хранятся на диске один раз. Файлы
+    не удаляются вместе с рецептами: один файл может принадлежать
+    нескольким рецептам, неиспользуемые удаляет команда `media_gc`.
+    """
+
+    hash_name = 'sha256'
+
+    def get_hashed_name(self, name, content):
+        digest = hashlib.new(self.hash_name)
+        for chunk in content.chunks():
+            digest.update(chunk)
+        digest = digest.hexdigest()
+        directory = os.path.dirname(name)
+        extension = os.path.splitext(name)[1].lower()
+        return os.path.join(directory, digest[:2], digest + extension)
+
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+        name = self.get_hashed_name(name, content)
+        if self.exists(name):
+            # Обновляем время изменения, чтобы media_gc не удалил файл,
+            # на который сейчас снова появится ссылка.
+            os.utime(self.path(name))
+            return name
+        return super().save(name, content, max_length)
@@ -1,5 +1,15 @@
-from django.http.response import HttpResponse
+import hashlib
+import re
+
+from django.conf import settings
+from django.contrib.postgres.search import TrigramSimilarity
+from django.db import connection, router, transaction
+from django.http import HttpResponse
+from django.http.response import StreamingHttpResponse
 from django.db.models import Sum
+from django.utils.cache import (get_conditional_response, patch_cache_control,
+                                patch_vary_headers)
+from django.utils.http import http_date, quote_etag
 from djoser.views import UserViewSet
 from rest_framework import status, viewsets
 from rest_framework.decorators import action
@@ -7,17 +17,89 @@ from rest_framework.generics import get_object_or_404
 from rest_framework.permissions import AllowAny, IsAuthenticated
 from rest_framework.response import Response
 
+from .caches import get_versions
 from .filters import IngredientNameFilter, RecipeFilter
-from .models import (Favorite, Follow, Ingredient, AmountIngredient,
-                     Purchase, Recipe, Tag, User)
-from .paginators import CustomPagination
+from .indexes import (ingredient_index, ingredient_responses,
+                      ingredient_trigram_index)
+from .models import (ContentVersion, Favorite, Follow, Ingredient,
+                     AmountIngredient, Purchase, Recipe, Tag, TimelineEntry,
+                     User)
+from .paginators import (CustomPagination, FeedCursorPagination,
+                         RecipeCursorPagination)
 from .permissions import IsOwnerOrAdminOrReadOnly
+from .renderers import (CSVShoppingCartRenderer, JSONShoppingCartRenderer,
+                        PDFShoppingCartRenderer, TextShoppingCartRenderer)
 from .serializers import (FavoritesSerializer, ListRecipeSerializer,
                           IngredientSerializer, PurchaseSerializer,
                           CreateUpdateRecipeSerializer, ShowFollowerSerializer,
                           TagSerializer, UserSerializer)
 
 
+class ConditionalGetMixin:
+    """ Поддержка условных запросов для `list` и `retrieve`.
+
+    ETag и Last-Modified строятся по счётчикам ContentVersion из
+    `version_keys`, поэтому ответ 304 отдаётся без выборки данных и
+    сериализации. При `per_user_version` учитывается счётчик текущего
+    пользователя: от его избранного, покупок и подписок зависит выдача.
+    """
+
+    version_keys = ()
+    per_user_version = False
+
+    def get_version_keys(self):
+        keys = list(self.version_keys)
+        user = self.request.user
+        if self.per_user_version and user.is_authenticated:
+            keys.append(ContentVersion.user_key(user.id))
+        return keys
+
+    def get_validators(self):
+        """ Возвращает список пар (метка версии, время изменения)
+        или None, если условный запрос обработать нельзя.
+        """
+        versions = get_versions(self.get_version_keys())
+        return [
+            (f'{key}.{version}', updated_at)
+            for key, (version, updated_at) in sorted(versions.items())
+        ]
+
+    def conditional(self, handler, request, *args, **kwargs):
+        validators = self.get_validators()
+        if validators is None:
+            return handler(request, *args, **kwargs)
+        etag = quote_etag(hashlib.md5(
+            ' '.join(label for label, _ in validators).encode()
+        ).hexdigest())
+        last_modified = max(
+            (int(updated_at.timestamp())
+             for _, updated_at in validators if updated_at),
+            default=None
+        )
+        response = get_conditional_response(
+            request, etag=etag, last_modified=last_modified
+        )
+        if response is None:
+            response = handler(request, *args, **kwargs)
+        if response.status_code in (status.HTTP_200_OK,
+                                    status.HTTP_304_NOT_MODIFIED):
+            response['ETag'] = etag
+            if last_modified is not None:
+                response['Last-Modified'] = http_date(last_modified)
+        if self.per_user_version:
+            patch_cache_control(response, no_cache=True, private=True)
+            patch_vary_headers(response, ('Authorization',))
+        else:
+            patch_cache_control(response, no_cache=True)
+        return response
+
+    def list(self, request, *args, **kwargs):
+        return self.conditional(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.conditional(super().retrieve, request, *args, **kwargs)
+
+
 class CustomUserViewSet(UserViewSet):
     queryset = User.objects.all()
     pagination_class = CustomPagination
@@ -62,7 +144,10 @@ class CustomUserViewSet(UserViewSet):
     )
     def subscriptions(self, request):
         user = request.user
-        queryset = Follow.objects.filter(user=user)
+        limit = request.GET.get('recipes_limit')
+        queryset = Follow.objects.filter(user=user).with_recipes(
+            int(limit) if limit and limit.isdigit() else None
+        )
         pages = self.paginate_queryset(queryset)
         serializer = ShowFollowerSerializer(
             pages,
@@ -72,26 +157,167 @@ class CustomUserViewSet(UserViewSet):
         return self.get_paginated_response(serializer.data)
 
 
-class TagViewSet(viewsets.ReadOnlyModelViewSet):
+class TagViewSet(ConditionalGetMixin, viewsets.ReadOnlyModelViewSet):
     queryset = Tag.objects.all()
+    version_keys = ('tags',)
     serializer_class = TagSerializer
     permission_classes = (AllowAny,)
     pagination_class = None
 
 
-class IngredientsViewSet(viewsets.ModelViewSet):
+class IngredientsViewSet(ConditionalGetMixin, viewsets.ModelViewSet):
     serializer_class = IngredientSerializer
     queryset = Ingredient.objects.all()
+    version_keys = ('ingredients',)
     pagination_class = None
     permission_classes = (AllowAny,)
     filterset_class = IngredientNameFilter
 
+    def fuzzy_search(self, query, limit):
+        """ Нечёткий поиск с ранжированием по схожести названия:
+        pg_trgm в PostgreSQL, триграммный индекс в памяти для остальных баз.
+        """
+        if connection.vendor != 'postgresql':
+            return ingredient_trigram_index.search(query, limit)
+        return Ingredient.objects.filter(
+            name__trigram_similar=query
+        ).annotate(
+            similarity=TrigramSimilarity('name', query)
+        ).order_by('-similarity', 'name')[:limit]
 
-class RecipeViewSet(viewsets.ModelViewSet):
+    def list(self, request, *args, **kwargs):
+        response = self.conditional(self.catalogue, request)
+        patch_vary_headers(response, ('Accept-Encoding',))
+        etag = response.get('ETag', '')
+        if response.has_header('Content-Encoding') and etag.startswith('"'):
+            # Сжатое представление отличается от исходного побайтно.
+            response['ETag'] = f'W/{etag}'
+        return response
+
+    def get_catalogue_key(self, request):
+        """ Ключ готового ответа: полный список или поиск по короткому
+        началу названия в JSON. None для остальных запросов.
+        """
+        params = request.query_params
+        if (set(params) - {'name'}
+                or request.accepted_renderer.format != 'json'
+                or ';' in request.accepted_media_type):
+            return None
+        if 'name' not in params:
+            return 'all'
+        name = params['name']
+        if len(name) > settings.INGREDIENT_RESPONSE_PREFIX_LENGTH:
+            return None
+        return f'name:{name.casefold()}'
+
+    def catalogue(self, request):
+        """ Полный список ингредиентов и поиск по началу названия
+        из одной-двух букв отдаются готовыми телами ответа, сжатыми
+        заранее (api.indexes.IngredientResponseCache), в кодировке
+        из Accept-Encoding.
+        """
+        key = self.get_catalogue_key(request)
+        encodings = key and ingredient_responses.get(
+            key, lambda: self.render_search(request)
+        )
+        if not encodings:
+            return self.search(request)
+        accepted = request.META.get('HTTP_ACCEPT_ENCODING', '')
+        encoding = next(
+            (encoding for encoding in ('br', 'gzip')
+             if encoding in encodings
+             and re.search(rf'\b{encoding}\b', accepted)),
+            'identity'
+        )
+        response = HttpResponse(
+            encodings[encoding],
+            content_type=request.accepted_renderer.media_type,
+        )
+        if encoding != 'identity':
+            response['Content-Encoding'] = encoding
+        return response
+
+    def render_search(self, request):
+        return request.accepted_renderer.render(
+            self.search(request).data, request.accepted_media_type,
+            self.get_renderer_context(),
+        )
+
+    def search(self, request):
+        """ Список ингредиентов с необязательным ограничением `limit`.
+
+        Поиск только по началу названия (`?name=`) обслуживается индексом
+        в памяти процесса без обращения к базе данных. С параметром
+        `fuzzy=1` поиск по названию допускает опечатки.
+        """
+        params = request.query_params
+        limit = params.get('limit')
+        limit = int(limit) if limit and limit.isdigit() else None
+        if params.get('name') and params.get('fuzzy') in ('1', 'true'):
+            ingredients = self.fuzzy_search(params['name'], limit)
+        elif 'name' in params and set(params) <= {'name', 'limit'}:
+            ingredients = ingredient_index.search(params['name'], limit)
+        else:
+            ingredients = self.filter_queryset(self.get_queryset())[:limit]
+        serializer = self.get_serializer(ingredients, many=True)
+        return Response(serializer.data)
+
+
+class RecipeViewSet(ConditionalGetMixin, viewsets.ModelViewSet):
     queryset = Recipe.objects.all()
     pagination_class = CustomPagination
     permission_classes = (IsOwnerOrAdminOrReadOnly,)
     filter_class = RecipeFilter
+    version_keys = ('tags', 'ingredients', 'users')
+    per_user_version = True
+
+    @property
+    def paginator(self):
+        """ С параметром `cursor` (пустым для первой страницы) список
+        выводится курсорной пагинацией без подсчёта количества рецептов.
+
+        При поиске (`search`) параметр `cursor` не учитывается: курсор
+        упорядочивает рецепты по дате публикации, а результаты поиска
+        выводятся по убыванию релевантности, поэтому для них остаётся
+        постраничная пагинация.
+        """
+        if not hasattr(self, '_paginator'):
+            params = self.request.query_params
+            if ('cursor' in params
+                    and not params.get('search', '').strip()):
+                self._paginator = RecipeCursorPagination()
+            else:
+                self._paginator = self.pagination_class()
+        return self._paginator
+
+    def get_version_keys(self):
+        keys = super().get_version_keys()
+        if self.action == 'list':
+            keys.append('recipes')
+        return keys
+
+    def get_validators(self):
+        """ Для отдельного рецепта вместо общего счётчика рецептов
+        используется его собственное время изменения.
+        """
+        validators = super().get_validators()
+        if self.action != 'retrieve':
+            return validators
+        pk = self.kwargs['pk']
+        updated_at = Recipe.objects.filter(pk=pk).values_list(
+            'updated_at', flat=True
+        ).first() if pk.isdigit() else None
+        if updated_at is None:
+            return None
+        validators.append((f'recipe.{pk}.{updated_at.timestamp()}',
+                           updated_at))
+        return validators
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.action in ('list', 'retrieve'):
+            return queryset.with_related()
+        return queryset
 
     def get_serializer_class(self):
         if self.request.method in ('POST', 'PUT', 'PATCH'):
@@ -99,7 +325,13 @@ class RecipeViewSet(viewsets.ModelViewSet):
         return ListRecipeSerializer
 
     def perform_create(self, serializer):
-        return serializer.save(author=self.request.user)
+        # Рецепт и записи лент сохраняются вместе: при ошибке рассылки
+        # не остаётся рецепта без записей, а повтор запроса клиентом
+        # не создаёт дубликат.
+        with transaction.atomic():
+            recipe = serializer.save(author=self.request.user)
+            TimelineEntry.objects.fan_out(recipe)
+        return recipe
 
     def recipe_post_method(self, request, AnySerializer, pk):
         user = request.user
@@ -160,21 +392,62 @@ class RecipeViewSet(viewsets.ModelViewSet):
             request, Purchase, pk
         )
 
+    @action(detail=False, permission_classes=[IsAuthenticated])
+    def feed(self, request):
+        """ Рецепты авторов, на которых подписан пользователь, от новых
+        к старым. Выводится курсорной пагинацией (`?cursor=`, `limit`).
+        """
+        paginator = FeedCursorPagination(Recipe.objects.with_related())
+        recipes = paginator.paginate_queryset(
+            TimelineEntry.objects.sources(request.user), request, view=self
+        )
+        serializer = self.get_serializer(recipes, many=True)
+        return paginator.get_paginated_response(serializer.data)
+
     @action(detail=False, methods=['get'],
-            permission_classes=[IsAuthenticated])
+            permission_classes=[IsAuthenticated],
+            renderer_classes=[TextShoppingCartRenderer,
+                              CSVShoppingCartRenderer,
+                              JSONShoppingCartRenderer,
+                              PDFShoppingCartRenderer])
     def download_shopping_cart(self, request):
-        queryset = self.get_queryset()
-        cart_objects = Purchase.objects.filter(user=request.user)
-        recipes = queryset.filter(purchases__in=cart_objects)
-        ingredients = AmountIngredient.objects.filter(recipes__in=recipes)
-        ing_types = Ingredient.objects.filter(
-            ingredients_amount__in=ingredients
-        ).annotate(total=Sum('ingredients_amount__amount'))
-
-        lines = [f'{ing_type.name}, {ing_type.total}'
-                 f' {ing_type.measurement_unit}' for ing_type in ing_types]
-        filename = 'shopping_ingredients.txt'
-        response_content = '\n'.join(lines)
-        response = HttpResponse(response_content, content_type='text/plain')
-        response['Content-Disposition'] = f'attachment; filename={filename}'
+        """ Выгрузка списка покупок в формате `?format=txt|csv|json|pdf`.
+
+        Ингредиенты суммируются одним запросом с группировкой и читаются
+        по мере отдачи ответа. ETag строится по версиям рецептов,
+        ингредиентов и данных пользователя, поэтому ответ 304 отдаётся
+        без выборки списка.
+        """
+        renderer = request.accepted_renderer
+        versions = get_versions((
+            'recipes', 'ingredients', ContentVersion.user_key(request.user.id)
+        ))
+        etag = quote_etag(hashlib.md5(' '.join(
+            [renderer.format] + [
+                f'{key}.{version}'
+                for key, (version, _) in sorted(versions.items())
+            ]
+        ).encode()).hexdigest())
+        response = get_conditional_response(request, etag=etag)
+        if response is None:
+            # Список читается уже после выхода из представления, когда
+            # ReplicaMiddleware сбросил выбор реплики, поэтому база
+            # задаётся явно - та же, из которой прочитаны версии.
+            ingredients = AmountIngredient.objects.using(
+                router.db_for_read(AmountIngredient)
+            ).filter(
+                recipe__purchases__user=request.user
+            ).values(
+                'ingredient__name', 'ingredient__measurement_unit'
+            ).annotate(
+                total=Sum('amount')
+            ).order_by('ingredient__name', 'ingredient__measurement_unit')
+            response = StreamingHttpResponse(
+                renderer.stream(ingredients.iterator()),
+                content_type=renderer.get_content_type()
+            )
+            response['Content-Disposition'] = (
+                f'attachment; filename={renderer.get_filename()}'
+            )
+        response['ETag'] = etag
         return response
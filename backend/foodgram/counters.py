@@ -0,0 +1,23 @@
+class CounterFieldsMixin:
+    """ Модель со счётчиками, которые изменяются только атомарным
+    `update` с F(). Сохранение объекта целиком их не записывает:
+    иначе значения, прочитанные в начале запроса, затёрли бы изменения,
+    сделанные за это время другими запросами.
+
+    Счётчики исключаются только из UPDATE при сохранении без
+    `update_fields`; вставка (новый объект, `force_insert` или запись,
+    которой уже нет в базе) идёт обычным путём Django со всеми полями.
+    """
+
+    counter_fields = ()
+
+    def _do_update(self, base_qs, using, pk_val, values, update_fields,
+                   forced_update):
+        if update_fields is None:
+            values = [
+                value for value in values
+                if value[0].name not in self.counter_fields
+            ]
+        return super()._do_update(
+            base_qs, using, pk_val, values, update_fields, forced_update
+        )
@@ -0,0 +1,68 @@
+import random
+from threading import local
+
+from django.conf import settings
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+# Токены читаются только из основной базы: отставание реплики вернуло бы
+# уже удалённый токен. Версии ContentVersion читаются из той же базы,
+# что и данные запроса (см. api.caches.get_versions).
+PRIMARY_MODELS = ('authtoken.Token',)
+
+_state = local()
+
+
+def get_replicas():
+    return [alias for alias in settings.DATABASES if alias != 'default']
+
+
+class ReplicaRouter:
+    """ Направляет чтение в реплики, пока ReplicaMiddleware разрешает
+    это для текущего запроса; запись, чтение моделей из PRIMARY_MODELS
+    и всё остальное чтение - в `default`.
+    """
+
+    def db_for_read(self, model, **hints):
+        if model._meta.label in PRIMARY_MODELS:
+            return 'default'
+        return getattr(_state, 'replica', None) or 'default'
+
+    def db_for_write(self, model, **hints):
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+
+class ReplicaMiddleware:
+    """ Разрешает чтение из реплики для безопасных запросов.
+
+    После запроса с изменением данных клиенту ставится cookie, и
+    settings.REPLICA_PIN_SECONDS он читает из основной базы, чтобы сразу
+    видеть свои изменения несмотря на отставание реплик. Метка хранится
+    только в cookie: кэш Django по умолчанию у каждого процесса свой
+    и не годится для неё.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        replicas = get_replicas()
+        if not replicas:
+            return self.get_response(request)
+        safe = request.method in SAFE_METHODS
+        if safe and settings.REPLICA_PIN_COOKIE not in request.COOKIES:
+            _state.replica = random.choice(replicas)
+        try:
+            response = self.get_response(request)
+        finally:
+            _state.replica = None
+        if not safe:
+            response.set_cookie(
+                settings.REPLICA_PIN_COOKIE, '1',
+                max_age=settings.REPLICA_PIN_SECONDS, httponly=True,
+                samesite='Lax',
+            )
+        return response
@@ -25,6 +25,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     'rest_framework',
     'rest_framework.authtoken',
     'djoser',
@@ -34,13 +35,16 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'api.middleware.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
+    'foodgram.db_router.ReplicaMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'api.middleware.ProfilerMiddleware',
 ]
 
 ROOT_URLCONF = 'foodgram.urls'
@@ -87,6 +91,22 @@ DATABASES = {
     }
 }
 
+# Реплики для чтения: через запятую хосты PostgreSQL или, для SQLite,
+# пути к файлам копий базы. Остальные параметры берутся из `default`.
+REPLICA_SETTING = (
+    'NAME' if DATABASES['default']['ENGINE'].endswith('sqlite3') else 'HOST'
+)
+for index, replica in enumerate(
+    filter(None, os.getenv('DB_REPLICAS', '').split(','))
+):
+    DATABASES[f'replica{index}'] = dict(
+        DATABASES['default'],
+        TEST={'MIRROR': 'default'},
+        **{REPLICA_SETTING: replica.strip()},
+    )
+
+DATABASE_ROUTERS = ['foodgram.db_router.ReplicaRouter']
+
 AUTH_PASSWORD_VALIDATORS = [
     {
         'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator',
@@ -119,15 +139,65 @@ STATIC_ROOT = os.path.join(BASE_DIR, 'static')
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+DEFAULT_FILE_STORAGE = 'api.storage.ContentAddressedStorage'
+
 AUTH_USER_MODEL = "users.CustomUser"
 
+SHOPPING_CART_PDF_FONT = os.getenv(
+    'SHOPPING_CART_PDF_FONT',
+    default='/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf'
+)
+SHOPPING_CART_PDF_WORKERS = int(os.getenv('SHOPPING_CART_PDF_WORKERS', 2))
+
+IMAGE_VARIANT_WIDTHS = (320, 640)
+IMAGE_VARIANT_QUALITY = 80
+IMAGE_VARIANT_WORKERS = int(os.getenv('IMAGE_VARIANT_WORKERS', 2))
+
+REFERENCE_CACHE_VERSION_TTL = float(
+    os.getenv('REFERENCE_CACHE_VERSION_TTL', 1)
+)
+MEMBERSHIP_CACHE_TIMEOUT = int(os.getenv('MEMBERSHIP_CACHE_TIMEOUT', 600))
+
+# Готовые сжатые ответы списка ингредиентов: полный список и поиск
+# по началу названия не длиннее INGREDIENT_RESPONSE_PREFIX_LENGTH.
+INGREDIENT_RESPONSE_PREFIX_LENGTH = 2
+INGREDIENT_RESPONSE_CACHE_SIZE = 1000
+
+# Кэш проверки токенов: записей в процессе, время жизни и хранение
+# в общем кэше Django.
+TOKEN_CACHE_SIZE = int(os.getenv('TOKEN_CACHE_SIZE', 10000))
+TOKEN_CACHE_TIMEOUT = int(os.getenv('TOKEN_CACHE_TIMEOUT', 300))
+TOKEN_CACHE_SHARED = os.getenv('TOKEN_CACHE_SHARED', '').lower() in (
+    '1', 'true', 'yes'
+)
+
+# Сколько секунд после изменения данных клиент читает из основной базы.
+REPLICA_PIN_SECONDS = int(os.getenv('REPLICA_PIN_SECONDS', 5))
+REPLICA_PIN_COOKIE = 'use_primary'
+
+# Заголовок X-DB-Queries с числом SQL-запросов, для команды loadtest.
+QUERY_COUNT_HEADER = os.getenv('QUERY_COUNT_HEADER', '').lower() in (
+    '1', 'true', 'yes'
+)
+
+# Профилирование запросов в каталог PROFILER_DIR: доля случайных запросов
+# и запросы сотрудников с заголовком X-Profile.
+PROFILER_DIR = os.getenv('PROFILER_DIR', '')
+PROFILER_SAMPLE_RATE = float(os.getenv('PROFILER_SAMPLE_RATE', 0))
+
+# Рецепты авторов, у которых подписчиков больше FEED_FANOUT_LIMIT,
+# не копируются в ленты подписчиков, а выбираются при чтении ленты.
+FEED_FANOUT_LIMIT = int(os.getenv('FEED_FANOUT_LIMIT', 1000))
+FEED_FANOUT_BATCH_SIZE = 500
+FEED_BACKFILL_SIZE = 50
+
 REST_FRAMEWORK = {
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.IsAuthenticated',
     ],
 
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication',
+        'api.authentication.CachedTokenAuthentication',
     ],
 
     'DEFAULT_FILTER_BACKENDS': [
@@ -1,8 +1,11 @@
 from django.contrib.auth.models import AbstractUser
-from django.db.models import CharField, EmailField, ManyToManyField
+from django.db.models import (CharField, EmailField, ManyToManyField,
+                              PositiveIntegerField)
 
+from foodgram.counters import CounterFieldsMixin
 
-class CustomUser(AbstractUser):
+
+class CustomUser(CounterFieldsMixin, AbstractUser):
 
     username = CharField(
         verbose_name='Уникальный username',
@@ -36,6 +39,18 @@ class CustomUser(AbstractUser):
         to='self',
         symmetrical=False,
     )
+    recipes_count = PositiveIntegerField(
+        verbose_name='Количество рецептов',
+        default=0,
+        editable=False,
+    )
+    followers_count = PositiveIntegerField(
+        verbose_name='Количество подписчиков',
+        default=0,
+        editable=False,
+    )
+
+    counter_fields = ('recipes_count', 'followers_count')
 
     USERNAME_FIELD = 'email'
     REQUIRED_FIELDS = ('username', 'first_name', 'last_name')